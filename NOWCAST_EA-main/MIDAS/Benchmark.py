@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the MIDAS classes on synthetic data (no Haver needed).
+
+python Benchmark.py [--out timings.json] [--quick] [--compare baseline.json] [--import-budget 0.5]
+
+Times OptimARoos, OptimMonthly, OptimMonthlyMultiDiff, WeightedMeanNaN, CombineForecasts, DelaySeries and ForecastCombine.Optimize while
+scaling the number of quarters, indicators, maxlag and MultiModel size, checks the fast engines against the sklearn
+reference, and writes everything to JSON. With --compare, cases more than 20% slower than the baseline file are reported.
+Importing MIDAS is timed in a fresh interpreter and fails the run if it takes longer than the import budget or loads
+any of the heavy modules that should only load on first use.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+import MIDAS
+from MIDAS import *
+from VintageStore import VintageStore
+
+dirname = os.path.dirname(os.path.abspath(__file__))
+
+
+def SyntheticData(T = 120, nseries = 4, seed = 0, ragged = 1, late = 1):
+    ## Monthly indicators and quarterly GDP driven by one AR(1) monthly factor, as ForecastCombine expects them:
+    ## T quarters of GDP, monthly series to ragged months short of the end of the nowcast quarter (quarter T+1),
+    ## the first late series start 20 months late and every second series one month shorter (ragged edge)
+    rng = np.random.default_rng(seed)
+    nmonths = 3*(T+1)
+    Factor = np.zeros(nmonths)
+    for tt in range(1, nmonths):
+        Factor[tt] = 0.5*Factor[tt-1] + rng.standard_normal()
+    monthlyseries = []
+    for jj in range(0, nseries):
+        Series = rng.uniform(0.3, 1)*Factor + rng.standard_normal(nmonths)
+        Series = Series[0:nmonths-ragged-(jj % 2)]
+        if jj < late:
+            Series[0:20] = np.nan
+        monthlyseries.append(Series.reshape(-1,1))
+    GDP = Factor[0:3*T].reshape(T,3).mean(axis=1) + 0.3*rng.standard_normal(T)
+    return GDP.reshape(-1,1), monthlyseries
+
+
+def OfflineHaver(root, requests, end = '2012-05', seed = 0):
+    ## synthetic data in the HaverCache.FileSource layout for every code of requests ((codes, database, frequency, startdate)
+    ## as HaverCache.Requests gives them): positive levels growing with one AR(1) monthly factor, monthly series to the end
+    ## month (the second of the nowcast quarter, so series released a month late still fit in it) and quarterly ones to the
+    ## quarter before it
+    rng = np.random.default_rng(seed)
+    Months = pd.period_range('1990-01', end, freq='M')
+    Factor = np.zeros(len(Months))
+    for tt in range(1, len(Months)):
+        Factor[tt] = 0.5*Factor[tt-1] + 0.5*rng.standard_normal()
+    for codes, database, frequency, startdate in requests:
+        for code in ([codes] if isinstance(codes, str) else codes):
+            Level = 100*np.exp(np.cumsum(0.002 + 0.01*(rng.uniform(0.3, 1)*Factor + rng.standard_normal(len(Months)))))
+            Series = pd.Series(Level, index=Months)
+            if str(frequency).upper() == 'Q':
+                Series = Series.groupby(Months.asfreq('Q')).mean()[:-1]
+            os.makedirs(os.path.join(root, str(database).upper()), exist_ok=True)
+            pd.DataFrame({'date': Series.index.astype(str), 'value': Series.values}).to_csv(os.path.join(root, str(database).upper(), code.lower() + '.csv'), index=False)
+
+
+def NowcastOffline(root):
+    ## NowcastGDP from every component script, on OfflineHaver data under root (cache under root too), charts not drawn
+    import HaverCache as hv
+    import NowcastGDP
+    Requests = hv.Requests([os.path.join(dirname, Component[1]) for Component in NowcastGDP.Components]) + [NowcastGDP.Levels()]
+    OfflineHaver(os.path.join(root, 'offline'), Requests)
+    Source, Cache, Memory = hv.Source, hv.Cache, dict(hv.Memory)
+    hv.Source, hv.Cache = hv.FileSource(os.path.join(root, 'offline')), hv.VintageCache(os.path.join(root, 'cache'))
+    hv.Memory.clear()
+    try:
+        Results = NowcastGDP.NowcastComponents()
+        return (Results,) + NowcastGDP.AggregateGDP(Results)
+    finally:
+        hv.Source, hv.Cache = Source, Cache
+        hv.Memory.clear()
+        hv.Memory.update(Memory)
+
+
+def Time(Run, repeat = 3):
+    ## best wall time of repeat runs of Run(), printed output suppressed
+    Best = np.inf
+    for rr in range(0, repeat):
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning) # pandas deprecations in the scripts' data handling
+            start_time = time.perf_counter()
+            Run()
+            Best = min(Best, time.perf_counter() - start_time)
+    return Best
+
+
+def Timings(quick = False):
+    ## list of {name, params, seconds} for each class and setting
+    Cases = []
+    Sizes = [80, 160] if quick else [80, 160, 320]
+    for T in Sizes:
+        GDP, monthly = SyntheticData(T = T, nseries = 8)
+        for ARt in [4, 8]:
+            Temp = OptimARoos(GDP)
+            Cases.append({'name': 'OptimARoos', 'params': {'T': T, 'ARt': ARt}, 'seconds': Time(lambda: Temp.Forecastperf(ARt, 30))})
+        for maxlag in [4, 8, 12]:
+            Temp = OptimMonthly(GDP, monthly[1])
+            Cases.append({'name': 'OptimMonthly', 'params': {'T': T, 'maxlag': maxlag}, 'seconds': Time(lambda: Temp.Forecastperf(30, maxlag))})
+            Cases.append({'name': 'OptimMonthly', 'params': {'T': T, 'maxlag': maxlag, 'select': 'press'}, 'seconds': Time(lambda: Temp.Forecastperf(30, maxlag, select = 'press'))})
+        for nvars, maxlag in [(2, 6), (3, 6), (2, 10)] + ([] if quick else [(4, 6), (3, 10)]):
+            Temp = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:nvars]))
+            # a fresh Gram cache each repeat, so the time includes building it
+            def Run():
+                MIDAS._GramCaches.clear()
+                Temp.Forecastperf(30, maxlag)
+            Cases.append({'name': 'OptimMonthlyMultiDiff', 'params': {'T': T, 'nvars': nvars, 'maxlag': maxlag}, 'seconds': Time(Run)})
+        for nseries in [4, 8]:
+            for maxlag, Multi in [(6, 0), (6, 2), (10, 3)]:
+                names = ['s%d' % jj for jj in range(0, nseries)]
+                def Run():
+                    MIDAS._GramCaches.clear()
+                    ForecastCombine(GDP = GDP, monthlyseries = monthly[0:nseries], skip = 30, ARt = 5, maxlag = maxlag, ARinclude = 1, weighttype = 'mse',
+                                    names = list(names), MultiModel = names[0:Multi]).Optimize()
+                Cases.append({'name': 'ForecastCombine.Optimize', 'params': {'T': T, 'nseries': nseries, 'maxlag': maxlag, 'MultiModel': Multi}, 'seconds': Time(Run)})
+        for nseries in [10, 100]:
+            Tseries = np.random.default_rng(1).standard_normal((T, nseries))
+            Tseries[Tseries > 1.5] = np.nan
+            Weights = np.random.default_rng(2).uniform(size=(1, nseries))
+            Cases.append({'name': 'WeightedMeanNaN', 'params': {'T': T, 'nseries': nseries}, 'seconds': Time(lambda: WeightedMeanNaN(Tseries, Weights), repeat = 20)})
+            Cube = np.stack([Tseries]*3, axis=2)
+            Cases.append({'name': 'CombineForecasts', 'params': {'T': T, 'nseries': nseries, 'schemes': 6},
+                          'seconds': Time(lambda: CombineForecasts(Cube, 1/Weights.T.repeat(3, axis=1), ['rmse', 'mse', 'equal', 'rank', 'topk', 'trimmed']), repeat = 20)})
+        Frame = pd.DataFrame(np.concatenate([Series[0:3*T] for Series in monthly], axis=1), index=pd.period_range('1990-01', periods=3*T, freq='M'))
+        Cases.append({'name': 'DelaySeries', 'params': {'T': T, 'nseries': Frame.shape[1]}, 'seconds': Time(lambda: DelaySeries(Frame.copy(), [1, 0]*(Frame.shape[1]//2)), repeat = 10)})
+    return Cases
+
+
+def Checks(tol = 1e-7):
+    ## fast engines against the sklearn reference (and process pools against serial), largest absolute difference
+    GDP, monthly = SyntheticData(T = 90, nseries = 3, seed = 3)
+    Results = []
+    def Check(name, Fast, Reference):
+        Diff = max(np.nanmax(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float))) if np.size(a) else 0 for a, b in zip(Fast, Reference))
+        Same = all(np.array_equal(np.isnan(np.asarray(a, dtype=float)), np.isnan(np.asarray(b, dtype=float))) for a, b in zip(Fast, Reference))
+        Results.append({'name': name, 'maxabs': float(Diff), 'ok': bool(Diff <= tol and Same)})
+    Runs = {}
+    for engine in ['rls', 'sklearn']:
+        Runs[engine] = OptimARoos(GDP)
+        Runs[engine].Forecastperf(5, 40, engine = engine)
+    Check('OptimARoos rls', (Runs['rls'].Fit_val, Runs['rls'].RMSE), (Runs['sklearn'].Fit_val, Runs['sklearn'].RMSE))
+    for engine in ['cholesky', 'sklearn']:
+        Runs[engine] = OptimMonthly(GDP, monthly[0])
+        Runs[engine].Forecastperf(40, 6, engine = engine)
+    Check('OptimMonthly cholesky', (Runs['cholesky'].Fit_val, Runs['cholesky'].Fit_valAR, Runs['cholesky'].RMSE), (Runs['sklearn'].Fit_val, Runs['sklearn'].Fit_valAR, Runs['sklearn'].RMSE))
+    for engine, n_jobs in [('gram', 1), ('sklearn', 1), ('gram', 2)]:
+        Runs[engine, n_jobs] = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:3]))
+        Runs[engine, n_jobs].Forecastperf(40, 5, engine = engine, n_jobs = n_jobs)
+    Check('OptimMonthlyMultiDiff gram', (Runs['gram', 1].Fit_val, Runs['gram', 1].Fit_valAR, Runs['gram', 1].RMSE), (Runs['sklearn', 1].Fit_val, Runs['sklearn', 1].Fit_valAR, Runs['sklearn', 1].RMSE))
+    Check('OptimMonthlyMultiDiff n_jobs=2', (Runs['gram', 2].Fit_val, Runs['gram', 2].RMSE), (Runs['gram', 1].Fit_val, Runs['gram', 1].RMSE))
+    Runs['mmap'] = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:3]))
+    Runs['mmap'].Forecastperf(40, 5, storage = 'mmap', memory = 2**20)
+    Check('OptimMonthlyMultiDiff mmap', (Runs['mmap'].OptimFit, Runs['mmap'].RMSE), (Runs['gram', 1].OptimFit, Runs['gram', 1].RMSE))
+    # a budget with room for the Gram cache, both float64 stores and a few combinations at a time: the peak has to stay under it
+    Panel = MonthlyPanel(monthly[0:3])
+    rows, ncombos = len(LagTensor(Panel, 5))-40, SearchSize(3, 5)
+    memory = GramCache.Estimate(LagTensor(Panel, 5), GDP[2:]) + 2*(ncombos+3)*TensorStore.Bytes('float64', rows)
+    for storage in ['float64', 'float32', 'topk']:
+        Runs['budget', storage] = OptimMonthlyMultiDiff(GDP, Panel)
+        Runs['budget', storage].Forecastperf(40, 5, storage = storage, memory = memory)
+        Check('OptimMonthlyMultiDiff %s memory budget' % storage, ([min(Runs['budget', storage].Counters['peakbytes'], memory)], Runs['budget', storage].OptimFit),
+              ([Runs['budget', storage].Counters['peakbytes']], Runs['gram', 1].OptimFit))
+    # with a pool: a Gram cache per worker, the shared copy of X and a chunk's fits twice (the workers' parts and the joined chunk)
+    memory = 2*GramCache.Estimate(LagTensor(Panel, 5), GDP[2:]) + LagTensor(Panel, 5).nbytes + 2*(2*4+3)*TensorStore.Bytes('float64', rows)
+    Runs['budget', 'n_jobs=2'] = OptimMonthlyMultiDiff(GDP, Panel)
+    Runs['budget', 'n_jobs=2'].Forecastperf(40, 5, storage = 'topk', topk = 3, memory = memory, n_jobs = 2)
+    Check('OptimMonthlyMultiDiff topk memory budget n_jobs=2', ([min(Runs['budget', 'n_jobs=2'].Counters['peakbytes'], memory)], Runs['budget', 'n_jobs=2'].OptimFit),
+          ([Runs['budget', 'n_jobs=2'].Counters['peakbytes']], Runs['gram', 1].OptimFit))
+    Runs['topk'] = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:3]))
+    Runs['topk'].Forecastperf(40, 5, storage = 'topk', topk = 2)
+    Check('OptimMonthlyMultiDiff topk', (Runs['topk'].OptimFit, Runs['topk'].RMSE, Runs['topk'].BestAR), (Runs['gram', 1].OptimFit, Runs['gram', 1].RMSE, Runs['gram', 1].BestAR))
+    for n_jobs in [1, 2]:
+        Runs['prune', n_jobs] = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:3]))
+        Runs['prune', n_jobs].Forecastperf(40, 5, prune = True, n_jobs = n_jobs)
+        Check('OptimMonthlyMultiDiff prune n_jobs=%d' % n_jobs, (Runs['prune', n_jobs].OptimFit, Runs['prune', n_jobs].OptimRMSE, Runs['prune', n_jobs].BestAR),
+              (Runs['gram', 1].OptimFit, Runs['gram', 1].OptimRMSE, Runs['gram', 1].BestAR))
+    for engine in ['rls', 'sklearn']:
+        Runs[engine, 'rolling'] = OptimARoos(GDP)
+        Runs[engine, 'rolling'].Forecastperf(5, 40, engine = engine, window = 24)
+    Check('OptimARoos rls rolling', (Runs['rls', 'rolling'].Fit_val, Runs['rls', 'rolling'].RMSE), (Runs['sklearn', 'rolling'].Fit_val, Runs['sklearn', 'rolling'].RMSE))
+    for engine in ['cholesky', 'sklearn']:
+        Runs[engine, 'rolling'] = OptimMonthly(GDP, monthly[0])
+        Runs[engine, 'rolling'].Forecastperf(40, 6, engine = engine, window = 24)
+    Check('OptimMonthly cholesky rolling', (Runs['cholesky', 'rolling'].Fit_val, Runs['cholesky', 'rolling'].Fit_valAR, Runs['cholesky', 'rolling'].RMSE),
+          (Runs['sklearn', 'rolling'].Fit_val, Runs['sklearn', 'rolling'].Fit_valAR, Runs['sklearn', 'rolling'].RMSE))
+    for engine in ['gram', 'sklearn']:
+        Runs[engine, 'multi rolling'] = OptimMonthlyMultiDiff(GDP, MonthlyPanel(monthly[0:3]))
+        Runs[engine, 'multi rolling'].Forecastperf(40, 5, engine = engine, window = 24)
+    Check('OptimMonthlyMultiDiff gram rolling', (Runs['gram', 'multi rolling'].Fit_val, Runs['gram', 'multi rolling'].Fit_valAR, Runs['gram', 'multi rolling'].RMSE),
+          (Runs['sklearn', 'multi rolling'].Fit_val, Runs['sklearn', 'multi rolling'].Fit_valAR, Runs['sklearn', 'multi rolling'].RMSE))
+    # the heuristic lag searches only visit combinations the exhaustive search also scores, so they can't beat it
+    GDP5, monthly5 = SyntheticData(T = 100, nseries = 5, seed = 1)
+    Runs['exhaustive'] = OptimMonthlyMultiDiff(GDP5, MonthlyPanel(monthly5))
+    Runs['exhaustive'].Forecastperf(40, 6)
+    for search in ['greedy', 'beam', 'coordinate']:
+        Runs[search] = OptimMonthlyMultiDiff(GDP5, MonthlyPanel(monthly5))
+        Runs[search].Forecastperf(40, 6, search = search)
+        Check('OptimMonthlyMultiDiff %s search' % search, (np.minimum(Runs[search].OptimRMSE, Runs['exhaustive'].OptimRMSE),), (Runs['exhaustive'].OptimRMSE,))
+    # leave-one-out RMSE from the hat matrix against refitting without each quarter
+    Z, Y = np.concatenate((MonthlyPanel(monthly[0:3])[3:3*len(GDP):3], GDP[0:-1]), axis=1), GDP[1:,0]
+    Rows = ~np.isnan(Z).any(axis=1)
+    Z, Y = Z[Rows], Y[Rows]
+    LOO = [Y[ii] - FitOLS(np.delete(Z, ii, axis=0), np.delete(Y, ii)) @ np.append(1, Z[ii]) for ii in range(0, len(Y))]
+    Check('SelectionScores press', ([SelectionScores(Z, Y)['press']],), ([np.sqrt(np.average(np.square(LOO)))],))
+    Runs['press'] = OptimMonthly(GDP, monthly[0])
+    Runs['press'].Forecastperf(40, 6, select = 'press')
+    Model = Runs['press'].OptimModel
+    Check('OptimMonthly select press', (Runs['press'].OptimFit.T,),
+          ([Runs['sklearn'].Fit_valAR[0:,Model[pp][0][0]-1,pp] if Model[pp][1] else Runs['sklearn'].Fit_val[0:,Model[pp][0][0]-1,pp] for pp in range(0,3)],))
+    # DelaySeries against the original row-shifting loop, on the PeriodIndex Haver gives and on the RangeIndex pd.merge
+    # leaves (ImportData_TradeContribution), plus the same frame with month start dates keeping its DatetimeIndex
+    def DelayLoop(DFmonth, Delay):
+        if np.any(~np.isnan(DFmonth.iloc[-1,np.asarray(Delay)==1])):
+            DFmonth = pd.concat([DFmonth, pd.DataFrame(index=DFmonth.index[-1:]+1, columns=DFmonth.columns)]).astype(float)
+        Hold = DFmonth.copy()
+        DFmonth = DFmonth[3:].copy()
+        for ii in range(len(Delay)):
+            DFmonth.iloc[:,ii] = Hold.iloc[3:,ii].values if Delay[ii]==0 else Hold.iloc[3-Delay[ii]:-Delay[ii],ii].values
+        return DFmonth
+    Frame = pd.DataFrame(np.concatenate([Series[0:60] for Series in monthly], axis=1), index=pd.period_range('1990-01', periods=60, freq='M'))
+    for Index in [Frame.index, pd.RangeIndex(60)]:
+        Delayed, Reference = DelaySeries(Frame.set_axis(Index, axis=0), [1, 0, 1]), DelayLoop(Frame.set_axis(Index, axis=0), [1, 0, 1])
+        Check('DelaySeries %s' % type(Index).__name__, (Delayed.values, [Delayed.index.equals(Reference.index)]), (Reference.values, [True]))
+    Delayed = DelaySeries(Frame.set_axis(Frame.index.to_timestamp(), axis=0), [1, 0, 1])
+    Reference = DelayLoop(Frame, [1, 0, 1])
+    Check('DelaySeries DatetimeIndex', (Delayed.values, [Delayed.index.equals(Reference.index.to_timestamp())]), (Reference.values, [True]))
+    # a 31 day lag releases the February 2024 value on March 31: known as of that day and in the March row
+    Frame = pd.DataFrame({'x': np.arange(1.0, 13.0)}, index=pd.period_range('2023-04', periods=12, freq='M'))
+    Aligned = AlignPanel(Frame, [31], asof = '2024-03-31', skip = 0)
+    Check('AlignPanel lag to a month end', ([Aligned.index[-1] == pd.Period('2024-03', freq='M')], Aligned['x'].values[-2:]), ([True], [10.0, 11.0]))
+    # vintage store recovering from an interrupted append (a stray value record), then appended to again with month start dates
+    with tempfile.TemporaryDirectory() as root:
+        Store = VintageStore(root)
+        Store.Append('x', pd.Series(np.arange(1.0, 7.0), index=pd.period_range('2000-01', periods=6, freq='M')), '2000-07-15')
+        with open(os.path.join(root, 'value'), 'ab') as Out:
+            Out.write(np.float64(99).tobytes())
+        Store = VintageStore(root)
+        Store.Append('x', pd.Series([50.0, 7.0], index=pd.date_range('2000-06-01', periods=2, freq='MS')), '2000-08-15')
+        Check('VintageStore interrupted append', (Store.Series('x').values, Store.Series('x', '2000-08-01').values),
+              ([1.0, 2.0, 3.0, 4.0, 5.0, 50.0, 7.0], np.arange(1.0, 7.0)))
+    # dates of month ends and of quarters starting in November read as the periods they mark, whatever pandas calls them
+    with tempfile.TemporaryDirectory() as root:
+        Store = VintageStore(root)
+        Store.Append('m', pd.Series([1.0, 2.0, 3.0], index=pd.DatetimeIndex(['2000-01-31', '2000-02-29', '2000-03-31'])), '2000-04-15')
+        Store.Append('q', pd.Series([1.0, 2.0, 3.0], index=pd.DatetimeIndex(['2000-02-01', '2000-05-01', '2000-08-01'])), '2000-12-15')
+        Check('VintageStore date frequencies', ([Store.Series('m').index.equals(pd.period_range('2000-01', periods=3, freq='M'))],
+              Store.Series('q').index.start_time.values.astype('datetime64[D]').astype(float)),
+              ([True], pd.DatetimeIndex(['2000-02-01', '2000-05-01', '2000-08-01']).values.astype('datetime64[D]').astype(float)))
+    # the expenditure side GDP nowcast runs every component script (none dropped) and adds them up to a finite nowcast
+    with tempfile.TemporaryDirectory() as root, warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning) # pandas deprecations in the scripts' data handling
+        Nowcasts, Table, GDP, GDPannual, Quarter = NowcastOffline(root)
+        Check('NowcastGDP all components', ([len(Nowcasts), np.isfinite(GDP)],), ([len(Table), True],))
+    return Results
+
+
+Heavy = ['pandas', 'matplotlib', 'sklearn', 'statsmodels', 'scipy', 'tabulate'] # loaded on first use, not by import MIDAS
+
+
+def ImportTime(budget = 0.5, repeat = 5):
+    ## best time of import MIDAS in a fresh interpreter (after a first run to compile), and the heavy modules it loaded
+    Code = ('import sys, time; start_time = time.perf_counter(); import MIDAS; seconds = time.perf_counter() - start_time; '
+            'print(seconds); print(" ".join(name for name in %r if name in sys.modules))' % (Heavy,))
+    Runs = [subprocess.run([sys.executable, '-c', Code], capture_output=True, text=True, cwd=dirname, check=True).stdout.split('\n')
+            for rr in range(0, repeat+1)][1:]
+    seconds = min(float(Run[0]) for Run in Runs)
+    Loaded = Runs[0][1].split()
+    return {'name': 'import MIDAS', 'seconds': seconds, 'budget': budget, 'loaded': Loaded, 'ok': bool(seconds <= budget and not Loaded)}
+
+
+def Compare(Timings, Baseline, slower = 1.2):
+    ## cases in Timings more than slower times the time of the same case in Baseline
+    Before = {(Case['name'], json.dumps(Case['params'], sort_keys=True)): Case['seconds'] for Case in Baseline}
+    return [dict(Case, baseline=Before[key]) for Case in Timings
+            for key in [(Case['name'], json.dumps(Case['params'], sort_keys=True))] if key in Before and Case['seconds'] > slower*Before[key]]
+
+
+def Commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=dirname).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmark the MIDAS classes on synthetic data')
+    Parser.add_argument('--out', default='benchmark.json', help='JSON file to write')
+    Parser.add_argument('--quick', action='store_true', help='smaller grid')
+    Parser.add_argument('--compare', help='earlier JSON output to compare timings against')
+    Parser.add_argument('--import-budget', type=float, default=0.5, help='seconds import MIDAS may take')
+    Args = Parser.parse_args()
+    Output = {'commit': Commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(),
+              'checks': Checks(), 'import': ImportTime(Args.import_budget), 'timings': Timings(Args.quick)}
+    with open(Args.out, 'w') as Out:
+        json.dump(Output, Out, indent=1)
+    for Case in Output['checks']:
+        print('%-35s %-5s max abs diff %.2e' % (Case['name'], 'ok' if Case['ok'] else 'FAIL', Case['maxabs']))
+    Import = Output['import']
+    print('%-35s %-5s %.3f s (budget %.3f s)%s' % (Import['name'], 'ok' if Import['ok'] else 'FAIL', Import['seconds'], Import['budget'],
+                                                   ' loaded ' + ', '.join(Import['loaded']) if Import['loaded'] else ''))
+    for Case in Output['timings']:
+        print('%-25s %-55s %.4f s' % (Case['name'], json.dumps(Case['params']), Case['seconds']))
+    if Args.compare:
+        for Case in Compare(Output['timings'], json.load(open(Args.compare))['timings']):
+            print('SLOWER %-25s %-55s %.4f s (was %.4f s)' % (Case['name'], json.dumps(Case['params']), Case['seconds'], Case['baseline']))
+    sys.exit(0 if all(Case['ok'] for Case in Output['checks']) and Output['import']['ok'] else 1)
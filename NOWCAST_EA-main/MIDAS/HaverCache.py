@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Drop-in replacement for the Haver module in the ImportData scripts (import HaverCache as hv).
+
+Each series pulled is kept on disk, one file per database, code, frequency, start date and vintage (the date it was
+pulled), so overlapping codes across scripts and repeated runs are read from disk instead of queried again.
+Without Haver installed, series are read from a local file-backed stand-in (FileSource) and the cache.
+"""
+import os
+import ast
+import glob
+import json
+import time
+import tempfile
+import threading
+import importlib.util
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import Haver
+except ImportError:
+    Haver = None
+
+dirname = os.path.dirname(os.path.abspath(__file__))
+
+# Parquet if an engine is installed, pickle otherwise
+Format = 'parquet' if importlib.util.find_spec('pyarrow') or importlib.util.find_spec('fastparquet') else 'pickle'
+
+
+class FileSource:
+    ## Local stand-in for Haver: one csv per series at root/DATABASE/code.csv, with columns date and value
+    ## (dates as anything pandas reads as a period of the series frequency, e.g. 2020-01 or 2020Q1)
+    def __init__(self, root):
+        self.root = root
+
+    def data(self, codes, database = None, frequency = None, startdate = None):
+        codes = [codes] if isinstance(codes, str) else list(codes)
+        Frames = []
+        for code in codes:
+            file = os.path.join(self.root, str(database).upper(), code.lower() + '.csv')
+            if not os.path.exists(file):
+                raise KeyError('%s@%s not found in %s' % (code, database, self.root))
+            Temp = pd.read_csv(file)
+            Frames.append(pd.Series(Temp['value'].values, index=pd.PeriodIndex(Temp['date'].values, freq=frequency), name=code.lower()))
+        Frame = pd.concat(Frames, axis=1)
+        return Frame.loc[startdate:] if startdate is not None else Frame
+
+    def Modified(self, code, database):
+        return os.path.getmtime(os.path.join(self.root, str(database).upper(), code.lower() + '.csv'))
+
+    def Save(self, Frame, database):
+        ## write each column of a frame of series (e.g. from Haver) to the stand-in, so later runs can work offline
+        os.makedirs(os.path.join(self.root, str(database).upper()), exist_ok=True)
+        for code in Frame.columns:
+            pd.DataFrame({'date': Frame.index.astype(str), 'value': Frame[code].values}).to_csv(os.path.join(self.root, str(database).upper(), code.lower() + '.csv'), index=False)
+
+
+class VintageCache:
+    ## On-disk cache of single series keyed by database, code, frequency, start date and vintage.
+    ## An entry is fresh for maxage seconds after it was pulled; after that Haver's last modified time is checked before
+    ## pulling again. Least recently used entries are removed once the files take more than maxbytes.
+    def __init__(self, root, maxbytes = 2**30, maxage = 12*3600):
+        self.root = root
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.lock = threading.Lock()
+        self.file = os.path.join(root, 'index.json')
+        os.makedirs(root, exist_ok=True)
+        self.index = self.Read()
+        self.changed = False # index differs from what was last written
+        self.removed = set() # keys evicted since, not to be merged back from the file
+
+    def Read(self):
+        ## index on disk, empty if missing or unreadable (e.g. cut short)
+        try:
+            with open(self.file) as In:
+                Index = json.load(In)
+        except (OSError, ValueError):
+            return {}
+        return Index if isinstance(Index, dict) else {}
+
+    def Key(self, database, code, frequency, startdate, vintage):
+        return '/'.join([str(database).upper(), code.lower(), str(frequency).upper(), str(startdate), vintage])
+
+    def Find(self, database, code, frequency, startdate, vintage = None):
+        ## key of the latest entry pulled on or before vintage (latest overall if None) covering startdate, or None
+        with self.lock:
+            Entries = list(self.index.items())
+        Found = [key for key, entry in Entries
+                 if (entry['database'], entry['code'], entry['frequency']) == (str(database).upper(), code.lower(), str(frequency).upper())
+                 and (entry['start'] == 'None' or (startdate is not None and pd.Timestamp(entry['start']) <= pd.Timestamp(startdate)))
+                 and (vintage is None or entry['vintage'] <= str(vintage))]
+        Fetched = dict((key, entry['fetched']) for key, entry in Entries)
+        return max(Found, key=Fetched.get) if Found else None
+
+    def Fresh(self, key):
+        ## False if the entry is stale or was evicted since Find (so the series is pulled again)
+        with self.lock:
+            return key in self.index and time.time() - self.index[key]['fetched'] < self.maxage
+
+    def Revalidated(self, key):
+        ## mark the entry under key as checked against the source now (no-op if it was evicted meanwhile)
+        with self.lock:
+            if key in self.index:
+                self.index[key]['fetched'] = time.time()
+                self.changed = True
+
+    def Get(self, key, startdate = None):
+        ## series stored under key, from startdate, or None if it was evicted since Find (a cache miss)
+        with self.lock:
+            if key not in self.index:
+                return None
+            entry = dict(self.index[key])
+            self.index[key]['used'] = time.time()
+            self.changed = True
+        file = os.path.join(self.root, entry['file'])
+        try:
+            Frame = pd.read_parquet(file) if entry['file'].endswith('.parquet') else pd.read_pickle(file)
+        except FileNotFoundError: # evicted by another process
+            return None
+        if entry['period']:
+            Frame.index = Frame.index.to_period(entry['period'])
+        return Frame.loc[startdate:] if startdate is not None else Frame
+
+    def Put(self, database, code, frequency, startdate, Frame, vintage = None):
+        ## store a one column frame of code as pulled now (vintage = today unless given)
+        vintage = time.strftime('%Y-%m-%d') if vintage is None else str(vintage)
+        key = self.Key(database, code, frequency, startdate, vintage)
+        name = '_'.join([code.lower(), str(frequency).upper(), str(startdate), vintage]) + ('.parquet' if Format == 'parquet' else '.pkl')
+        os.makedirs(os.path.join(self.root, str(database).upper()), exist_ok=True)
+        file = os.path.join(str(database).upper(), name)
+        Out = Frame.copy()
+        period = Out.index.freqstr if isinstance(Out.index, pd.PeriodIndex) else None
+        if period:
+            Out.index = Out.index.to_timestamp()
+        # written to a temporary file of this process and moved in place, so another process never reads it half written
+        handle, temp = tempfile.mkstemp(dir=os.path.join(self.root, str(database).upper()), suffix='.tmp')
+        os.close(handle)
+        try:
+            Out.to_parquet(temp) if Format == 'parquet' else Out.to_pickle(temp)
+            os.replace(temp, os.path.join(self.root, file))
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        with self.lock:
+            self.index[key] = {'database': str(database).upper(), 'code': code.lower(), 'frequency': str(frequency).upper(),
+                               'start': str(startdate), 'vintage': vintage, 'file': file, 'period': period, 'fetched': time.time(),
+                               'used': time.time(), 'bytes': os.path.getsize(os.path.join(self.root, file))}
+            self.removed.discard(key)
+            self.changed = True
+        return key
+
+    def Evict(self):
+        ## remove least recently used entries until the cache fits in maxbytes
+        with self.lock:
+            while sum(entry['bytes'] for entry in self.index.values()) > self.maxbytes and len(self.index) > 1:
+                key = min(self.index, key=lambda key: self.index[key]['used'])
+                file = os.path.join(self.root, self.index.pop(key)['file'])
+                self.removed.add(key)
+                self.changed = True
+                if os.path.exists(file):
+                    os.remove(file)
+
+    def Write(self):
+        ## save the index if it changed (atomic replace from a temporary file of this process, so an interrupted run leaves
+        ## the previous index). Merged with the index on disk first, so processes sharing the cache (e.g. the NowcastGDP
+        ## workers) keep each other's entries: the most recently used or revalidated copy of an entry wins, and entries evicted here or
+        ## whose file is gone are dropped.
+        with self.lock:
+            if not self.changed:
+                return
+            Index = {key: entry for key, entry in self.Read().items() if key not in self.removed}
+            for key, entry in self.index.items():
+                if key not in Index or max(entry['used'], entry['fetched']) >= max(Index[key].get('used', 0), Index[key].get('fetched', 0)):
+                    Index[key] = entry
+            self.index = {key: entry for key, entry in Index.items() if os.path.exists(os.path.join(self.root, entry['file']))}
+            handle, temp = tempfile.mkstemp(dir=self.root, prefix='index.', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w') as Out:
+                    json.dump(self.index, Out)
+                os.replace(temp, self.file)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+            self.changed, self.removed = False, set()
+
+
+Memory = {} # series pulled by Prefetch in this session, by database, code, frequency and start date
+Cache = VintageCache(os.environ.get('HAVER_CACHE', os.path.join(dirname, 'haver_cache')))
+Source = Haver if Haver is not None else FileSource(os.environ.get('HAVER_OFFLINE', os.path.join(dirname, 'haver_offline')))
+
+
+def path(location):
+    ## as Haver.path, nothing to set for the file-backed stand-in
+    if Haver is not None:
+        Haver.path(location)
+
+
+def Unchanged(key, database, code):
+    ## True if the source reports no revision to the series since the cached entry was pulled
+    try:
+        if Haver is None:
+            modified = Source.Modified(code, database)
+        else:
+            modified = pd.Timestamp(Haver.metadata([code], database)['datetimemod'].iloc[0]).timestamp()
+    except Exception:
+        return False
+    with Cache.lock:
+        return key in Cache.index and modified < Cache.index[key]['fetched']
+
+
+def data(codes, database = None, frequency = None, startdate = None, vintage = None, refresh = False):
+    ## as Haver.data, through the cache. Series are returned from the cache if fresh (or unrevised since pulled), the rest
+    ## are pulled in one query and stored under today's vintage.
+    ## vintage = date, returns the series as pulled on or before that date from the cache only (for reproducible runs)
+    ## refresh = True pulls every series again
+    codes = [codes] if isinstance(codes, str) else list(codes)
+    Frames, Missing = {}, []
+    for code in codes:
+        if vintage is None and not refresh and (str(database).upper(), code.lower(), str(frequency).upper(), str(startdate)) in Memory:
+            Frames[code] = Memory[(str(database).upper(), code.lower(), str(frequency).upper(), str(startdate))]
+            continue
+        key = Cache.Find(database, code, frequency, startdate, None if vintage is None else pd.Timestamp(vintage).strftime('%Y-%m-%d'))
+        # Fresh, Unchanged and Get treat an entry evicted meanwhile (e.g. by a Prefetch thread) as a miss
+        if vintage is not None:
+            Frame = Cache.Get(key, startdate) if key is not None else None
+            if Frame is None:
+                raise KeyError('no vintage of %s@%s on or before %s in %s' % (code, database, vintage, Cache.root))
+            Frames[code] = Frame
+            continue
+        fresh = key is not None and not refresh and Cache.Fresh(key)
+        Frame = Cache.Get(key, startdate) if fresh or (key is not None and not refresh and Unchanged(key, database, code)) else None
+        if Frame is None:
+            Missing.append(code)
+            continue
+        if not fresh:
+            Cache.Revalidated(key)
+        Frames[code] = Frame
+    if Missing:
+        try:
+            Pulled = Source.data(Missing, database, frequency=frequency, startdate=startdate)
+        except Exception:
+            # offline: fall back to the latest cached vintage, however old
+            Pulled = None
+            for code in Missing:
+                key = Cache.Find(database, code, frequency, startdate)
+                Frames[code] = Cache.Get(key, startdate) if key is not None else None
+                if Frames[code] is None:
+                    raise
+        if Pulled is not None:
+            Pulled.columns = [column.lower() for column in Pulled.columns]
+            for code in Missing:
+                if code.lower() in Pulled.columns:
+                    Frames[code] = Pulled[[code.lower()]]
+                    Cache.Put(database, code, frequency, startdate, Frames[code])
+        Cache.Evict()
+    Cache.Write()
+    return pd.concat([Frames[code] for code in codes if code in Frames], axis=1)
+
+
+def Requests(scripts):
+    ## (codes, database, frequency, startdate) of every hv.data call in the scripts, found without running them. Names
+    ## in the call are resolved from the literal assignments above it (e.g. HVdb, Reg_codes, begindate)
+    Calls = []
+    for script in scripts:
+        Names = {}
+        def Value(node):
+            if isinstance(node, ast.Name):
+                return Names.get(node.id)
+            try:
+                return ast.literal_eval(node)
+            except ValueError:
+                return None
+        for Statement in ast.parse(open(script).read()).body:
+            for Node in ast.walk(Statement):
+                if isinstance(Node, ast.Call) and isinstance(Node.func, ast.Attribute) and Node.func.attr == 'data' and getattr(Node.func.value, 'id', None) == 'hv':
+                    Args = dict(zip(['codes', 'database', 'frequency', 'startdate'], [Value(arg) for arg in Node.args]))
+                    Args.update({keyword.arg: Value(keyword.value) for keyword in Node.keywords})
+                    if Args.get('codes') and Args.get('database'):
+                        codes = [Args['codes']] if isinstance(Args['codes'], str) else list(Args['codes'])
+                        Calls.append((codes, Args['database'], Args.get('frequency'), Args.get('startdate')))
+            if isinstance(Statement, ast.Assign) and len(Statement.targets) == 1 and isinstance(Statement.targets[0], ast.Name):
+                Names[Statement.targets[0].id] = Value(Statement.value)
+    return Calls
+
+
+def Prefetch(scripts = None, workers = 3, requests = ()):
+    ## Pull everything the component scripts need before running them: the codes of all their hv.data calls are deduplicated
+    ## and each database, frequency and start date group is fetched in one data() call (through the disk cache), with at
+    ## most workers groups at once. The scripts' own hv.data calls are then served from Memory.
+    ## scripts defaults to the ImportData_*.py component scripts, requests = more (codes, database, frequency, startdate)
+    ## to fetch with them (e.g. what the caller pulls itself afterwards)
+    scripts = sorted(glob.glob(os.path.join(dirname, 'ImportData_*.py'))) if scripts is None else scripts
+    Groups = {}
+    for codes, database, frequency, startdate in Requests(scripts) + list(requests):
+        codes = [codes] if isinstance(codes, str) else codes
+        Group = Groups.setdefault((str(database).upper(), str(frequency).upper(), startdate), [])
+        Group.extend(code for code in codes if code.lower() not in [known.lower() for known in Group])
+    def Fetch(Group):
+        (database, frequency, startdate), codes = Group
+        Frame = data(codes, database, frequency=frequency, startdate=startdate)
+        for code in codes:
+            if code.lower() in Frame.columns:
+                Memory[(database, code.lower(), frequency, str(startdate))] = Frame[[code.lower()]]
+        return len(codes)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(Groups)))) as Pool:
+        Counts = list(Pool.map(Fetch, Groups.items()))
+    return dict(zip(Groups, Counts)) # codes fetched in each group
@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from MIDAS import *
 import datetime as dt
-import Haver as hv
+import HaverCache as hv # Haver through the local vintage cache
 
 dirname = os.path.dirname(__file__)
 hv.path('auto') # path for Haver 
@@ -11,7 +11,7 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 from MIDAS import *
 import datetime as dt
-import Haver as hv
+import HaverCache as hv # Haver through the local vintage cache
 
 dirname = os.path.dirname(__file__)
 hv.path('auto') # path for Haver 
@@ -5,22 +5,64 @@
 @author: Gene Kindberg-Hanlon
 """
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
-from tabulate import tabulate
-from statsmodels.tsa.arima.model import ARIMA
-import pandas as pd
 import itertools as iter
 import time
+import os
+import sys
+import atexit
+import contextlib
+import hashlib
+import json
+import pickle
+import importlib
+import tempfile
+import math
+import warnings
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-pd.options.mode.chained_assignment = None 
+
+class LazyImport:
+    ## Stand-in for a module (or an object in it) that is imported on first use, so that importing MIDAS for a backtest
+    ## loads only NumPy. Modules already imported by the caller are bound at once. OnLoad(module) runs after the import.
+    def __init__(self, module, attribute = None, OnLoad = None):
+        self.__dict__.update(module=module, attribute=attribute, OnLoad=OnLoad, target=None)
+        if module in sys.modules:
+            self.Load()
+
+    def Load(self):
+        if self.target is None:
+            Module = importlib.import_module(self.module)
+            if self.OnLoad is not None:
+                self.OnLoad(Module)
+            self.__dict__['target'] = getattr(Module, self.attribute) if self.attribute else Module
+        return self.target
+
+    def __getattr__(self, name):
+        return getattr(self.Load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.Load(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self.Load()(*args, **kwargs)
+
+
+# plotting, reporting, pandas and the sklearn reference engine load on first use
+plt = LazyImport('matplotlib.pyplot')
+LinearRegression = LazyImport('sklearn.linear_model', 'LinearRegression')
+tabulate = LazyImport('tabulate', 'tabulate')
+pd = LazyImport('pandas', OnLoad=lambda pd: setattr(pd.options.mode, 'chained_assignment', None))
 
 class OptimAR:
     def __init__(self, GDP):
         self.GDP = GDP
 
         
-    def Forecastperf(self, ARt): # not out of sample AR forecast evaluation
+    def Forecastperf(self, ARt, criterion = 'rmse'): # not out of sample AR forecast evaluation
+        # criterion = lag order chosen on the in-sample 'rmse', or on the leave-one-out RMSE ('press'), 'aic' or 'bic'
+        # (see SelectionScores), all of them kept in self.Scores
         self.ARt = ARt
         GDP = self.GDP
         length = len(GDP)-ARt
@@ -39,64 +81,69 @@ class OptimAR:
         
         self.RMSE = RMSE
         self.Fit_val = Fit_val
-        self.BestAR = RMSE.argmin() # location of lowest
+        Scores = [SelectionScores(X[0:,0:ii], Y[0:,0]) for ii in range(1,ARt+1)]
+        self.Scores = {name: np.array([[Score[name] for Score in Scores]]) for name in Criteria}
+        self.BestAR = RMSE.argmin() if criterion == 'rmse' else self.Scores[criterion].argmin() # location of lowest
             
     def PlotBest(self):
         #something
         Y = self.GDP[self.ARt:]
         Y_fit = self.Fit_val[0:,self.BestAR]
-        fig2 = plt.figure(figsize=(15,15))
-        ax1 = fig2.add_subplot(111)
-        ax1.plot(range(0,len(Y)), Y,marker='', color='olive', linewidth=2)
-        ax1.plot(range(0,len(Y)), Y_fit, marker='', color='blue', linewidth=2)
-        ax1.legend(['Fitted', 'data'], loc='upper left')
-        plt.show()        
+        ShowChart({'name': 'OptimAR', 'panels': [{'lines': [(range(0,len(Y)), Y, '', 'olive'), (range(0,len(Y)), Y_fit, '', 'blue')], 'legend': ['Fitted', 'data']}]})
 
 class OptimARoos: ## Out of sample forecast evaluation
     def __init__(self, GDP):
         self.GDP = GDP
 
         
-    def Forecastperf(self, ARt, skip):
+    def Forecastperf(self, ARt, skip, engine = 'rls', window = None):
+        # engine = 'rls' updates the coefficients recursively as each quarter is added, 'sklearn' refits every window (reference)
+        # window = estimate on rolling windows of the last window quarters (the oldest quarter taken out as each one is added),
+        # expanding windows from the first quarter if None
+        start_time = time.perf_counter()
         self.ARt = ARt
         self.skip = skip
+        self.window = window
         GDP = self.GDP
         length = len(GDP)-ARt
         X = np.zeros(shape=(length,ARt))
         # create various lag lengths
         for ii in range(1,ARt+1):
-            X[0:,ii-1] = GDP[ARt-ii:-ii].T 
-        
+            X[0:,ii-1] = GDP[ARt-ii:-ii].T
+
         Y = GDP[ARt:].reshape(-1,1)
         # create fitted values and test RMSE
-        
+
         Fit_val = np.zeros(shape=(length-skip+1,ARt)) # plus 1 for forecast peiod
         RMSE = np.zeros(shape=(1,ARt))
-        
+
         for ii in range(1,ARt+1):
-            for jj in range(skip, length):
-                Temp = LinearRegression().fit(X[0:jj,0:ii].reshape(-1,ii), Y[0:jj,0])
-                Fit_val[jj-skip:jj+1-skip,ii-1] = Temp.predict(X[jj:jj+1,0:ii].reshape(-1,ii)).T
+            if engine == 'rls':
+                # coefficients for every expanding window 0:jj, jj = skip..length-1
+                Coefs = RecursiveLS(X[0:,0:ii], Y[0:,0], start=skip, stop=length-1, window=window)
+                Fit_val[0:length-skip,ii-1] = Coefs[0:,0] + np.einsum('ij,ij->i', X[skip:,0:ii], Coefs[0:,1:])
+                Fit_val[length-skip,ii-1] = Coefs[-1,0] + Y[-ii:,0] @ Coefs[-1,1:] # forecast quarter for each lag
+            else:
+                for jj in range(skip, length):
+                    lo = WindowStart(jj, window)
+                    Temp = LinearRegression().fit(X[lo:jj,0:ii].reshape(-1,ii), Y[lo:jj,0])
+                    Fit_val[jj-skip:jj+1-skip,ii-1] = Temp.predict(X[jj:jj+1,0:ii].reshape(-1,ii)).T
+                Fit_val[length-skip:length-skip+1,ii-1] = Temp.predict(Y[-ii:,:].reshape(-1,ii)).T # forecast quarter for each lag
             RMSE[0,ii-1] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_val[0:-1,ii-1])))
-            Fit_val[length-skip:length-skip+1,ii-1] = Temp.predict(Y[-ii:,:].reshape(-1,ii)).T # forecast quarter for each lag
-            
+
         self.RMSE = RMSE
         self.Fit_val = Fit_val
         self.BestAR = RMSE.argmin() # location of lowest
         self.OptimFit = Fit_val[0:,self.BestAR]
         self.OptimRMSE = RMSE[0,self.BestAR]
+        self.Counters = StageCounters(start_time, ARt*(length-skip), ARt*sum(jj-WindowStart(jj, window) for jj in range(skip, length)), X, Fit_val)
         
     def PlotBest(self):
         #something
         Y = self.GDP[self.ARt:]
         Y = Y[self.skip:]
         Y_fit = self.Fit_val[0:,self.BestAR]
-        fig2 = plt.figure(figsize=(15,15))
-        ax1 = fig2.add_subplot(111)
-        ax1.plot(range(0,len(Y)), Y,marker='', color='olive', linewidth=2)
-        ax1.plot(range(0,len(Y_fit)), Y_fit, marker='', color='blue', linewidth=2)
-        ax1.legend(['Fitted', 'data'], loc='upper left')
-        plt.show()        
+        ShowChart({'name': 'OptimARoos', 'panels': [{'lines': [(range(0,len(Y)), Y, '', 'olive'), (range(0,len(Y_fit)), Y_fit, '', 'blue')], 'legend': ['Fitted', 'data']}]})
         
 
 
@@ -107,23 +154,50 @@ class OptimMonthly:
         self.monthly = monthly
 
     # Single variable assessment
-    def Forecastperf(self, skip, maxlag):
+    def Select(self, maxlag, criterion = 'press', X = None):
+        # Rank every lag length with and without Ylag in each month from one in-sample fit each (SelectionScores), no backtest:
+        # cheap enough to screen hundreds of indicators. Fitted on every quarter with GDP, so it sees the whole sample.
+        # Scores of each criterion kept in self.Scores and self.ScoresAR (month x lag length), chosen model in self.OptimModel
+        self.maxlag = maxlag
+        startq = int(np.ceil(maxlag/3)) # to match indexing convention
+        Y = self.GDP[startq:,0]
+        Ylag = self.GDP[startq-1:,0]
+        if X is None:
+            X = LagTensor(self.monthly, maxlag)[0:,0:,0:,0]
+        n = min(len(X), len(Y))
+        Scores = [[SelectionScores(X[0:n,0:ii,pp], Y[0:n]) for ii in range(1,maxlag+1)] for pp in range(0,3)]
+        ScoresAR = [[SelectionScores(np.concatenate((X[0:n,0:ii,pp], Ylag[0:n,None]), axis=1), Y[0:n]) for ii in range(1,maxlag+1)] for pp in range(0,3)]
+        self.Scores = {name: np.array([[Score[name] for Score in Month] for Month in Scores]) for name in Criteria}
+        self.ScoresAR = {name: np.array([[Score[name] for Score in Month] for Month in ScoresAR]) for name in Criteria}
+        self.criterion = criterion
+        BestnoAR, BestAR = self.Scores[criterion].argmin(axis=1), self.ScoresAR[criterion].argmin(axis=1)
+        self.OptimModel = [((BestnoAR[ii]+1,), False) if self.Scores[criterion][ii, BestnoAR[ii]] < self.ScoresAR[criterion][ii, BestAR[ii]] else ((BestAR[ii]+1,), True)
+                           for ii in range(0,3)]
+        self.BestAR = np.array([Model[0][0]-1 for Model in self.OptimModel])
+        return self.OptimModel
+
+    def Forecastperf(self, skip, maxlag, engine = 'cholesky', X = None, window = None, select = 'oos'):
+        # engine = 'cholesky' reads every lag length off one factorization per window, 'sklearn' refits every model (reference)
+        # X = store of regressors from LagTensor if already built (e.g. for all indicators at once)
+        # window = estimate on rolling windows of the last window quarters, expanding windows if None
+        # select = 'oos' chooses the lags on the out of sample RMSE; 'press', 'aic' or 'bic' pre-select them with Select and
+        # backtest only the chosen model in each month (the other entries of Fit_val, Fit_valAR and RMSE are NaN)
+        if engine not in ('cholesky', 'sklearn'):
+            raise ValueError("engine must be 'cholesky' or 'sklearn'")
+        start_time = time.perf_counter()
         self.skip = skip
         self.maxlag = maxlag
-        monthly = self.monthly[0:]
-        length = np.int(np.ceil(len(monthly)/3))
-        monthly = np.append(monthly, np.full(length*3-len(monthly),np.nan)) # fill remainder of monthly with NaN
-        startq = np.int(np.ceil(maxlag/3)) # to match indexing convention
+        self.window = window
+        length = int(np.ceil(len(self.monthly)/3))
+        startq = int(np.ceil(maxlag/3)) # to match indexing convention
         GDP = self.GDP[startq:,0:] # allow space for lagged monthly data
         GDPlag = self.GDP[startq-1:,0:]
-        X = np.zeros(shape=(length-startq,maxlag+1,3))
         # create various lag lengths
         # X time, lag, month (month 1, 2, 3), i.e. Jan, Feb, March in Q1
         ###########################
         # Make store of regressors X (quarter, monthly data up to max lag, month of quarter)
-        for jj in range(0,3):
-            for ii in range(0,maxlag+1):
-                X[0:,ii,jj] = monthly[startq*3-ii+jj:len(monthly)-ii+jj:3].T # every third element for each lag 
+        if X is None:
+            X = LagTensor(self.monthly, maxlag)[0:,0:,0:,0]
          
         Y = GDP.reshape(-1,1)
         Ylag = GDPlag.reshape(-1,1)
@@ -135,26 +209,50 @@ class OptimMonthly:
         Fit_valAR = np.zeros(shape=(length-skip-startq,maxlag,3))
         RMSEAR = np.zeros(shape=(3,maxlag))
         
+        if select != 'oos':
+            self.Select(maxlag, select, X)
+            for Array in (Fit_val, Fit_valAR, RMSE, RMSEAR):
+                Array[...] = np.nan
+            stop = min(len(X)-1, len(Y))
+            self.OptimFit, self.OptimRMSE = np.zeros(shape=(len(Fit_val),3)), np.zeros(3)
+            for pp in range(0,3): # Months
+                (ii,), AR = self.OptimModel[pp]
+                Out, Scores = (Fit_valAR, RMSEAR) if AR else (Fit_val, RMSE)
+                Out[0:stop+1-skip,ii-1,pp] = ModelBacktest(X[0:,0:,0:,None], Y, Ylag, (ii,), pp, AR, skip, stop, window) # one model, any engine
+                Scores[pp,ii-1] = np.sqrt(np.average(np.square(Y[skip:,0]-Out[0:len(Y)-skip,ii-1,pp])))
+                self.OptimFit[0:,pp], self.OptimRMSE[pp] = Out[0:,ii-1,pp], Scores[pp,ii-1]
+            self.RMSE, self.RMSEAR = RMSE, RMSEAR
+            self.Fit_val, self.Fit_valAR = Fit_val, Fit_valAR
+            windows = range(skip, stop+1)
+            self.Counters = StageCounters(start_time, 3*2*maxlag + 3*len(windows), 3*2*maxlag*min(len(X), len(Y)) + 3*sum(jj-WindowStart(jj, window) for jj in windows), X, Fit_val, Fit_valAR)
+            return
+
         #Model = [[None for col in range(maxlag)] for row in range(3)] # holds latest monthxlag regression
         for pp in range(0,3): # Months
+            if engine == 'cholesky':
+                # all lag lengths with and without Ylag for every window jj = skip..stop
+                stop = min(len(X)-1, len(Y))
+                Fit_val[0:stop+1-skip,0:,pp], Fit_valAR[0:stop+1-skip,0:,pp] = OrderRecursiveOLS(X[0:,0:maxlag,pp], Y[0:,0], Ylag[0:,0], skip, stop, window)
             for ii in range(1,maxlag+1): # Up to maxlag
-                for jj in range(skip, len(X)): 
-                    if jj<=len(Y):
-                        # Exclude nan values if early series data not available
-                        RegDatX, RegDatY = X[0:jj,0:ii,pp].reshape(-1,ii), Y[0:jj,0].reshape(-1,1)
-                        Model = LinearRegression().fit(RegDatX[~np.isnan(RegDatX).any(axis=1),0:].reshape(-1,ii), RegDatY[~np.isnan(RegDatX).any(axis=1),0])
-                        if np.isnan(X[jj:jj+1,0:ii,pp]).any():
-                            Fit_val[jj-skip:jj+1-skip,ii-1,pp] = np.nan
-                        else:
-                            Fit_val[jj-skip:jj+1-skip,ii-1,pp] = Model.predict(X[jj:jj+1,0:ii,pp].reshape(-1,ii)).T
+                if engine == 'sklearn':
+                    for jj in range(skip, len(X)): 
+                        if jj<=len(Y):
+                            # Exclude nan values if early series data not available
+                            lo = WindowStart(jj, window)
+                            RegDatX, RegDatY = X[lo:jj,0:ii,pp].reshape(-1,ii), Y[lo:jj,0].reshape(-1,1)
+                            Model = LinearRegression().fit(RegDatX[~np.isnan(RegDatX).any(axis=1),0:].reshape(-1,ii), RegDatY[~np.isnan(RegDatX).any(axis=1),0])
+                            if np.isnan(X[jj:jj+1,0:ii,pp]).any():
+                                Fit_val[jj-skip:jj+1-skip,ii-1,pp] = np.nan
+                            else:
+                                Fit_val[jj-skip:jj+1-skip,ii-1,pp] = Model.predict(X[jj:jj+1,0:ii,pp].reshape(-1,ii)).T
                             
-                        RegDatXAR = np.concatenate((X[0:jj,0:ii,pp].reshape(-1,ii), Ylag[0:jj,0].reshape(-1,1)), axis=1)
-                        ModelAR = LinearRegression().fit(RegDatXAR[~np.isnan(RegDatX).any(axis=1),0:].reshape(-1,ii+1), RegDatY[~np.isnan(RegDatXAR).any(axis=1),0])
-                        if np.isnan(X[jj:jj+1,0:ii,pp]).any():
-                            Fit_valAR[jj-skip:jj+1-skip,ii-1,pp] = np.nan
-                        else:
-                            Xpred = np.concatenate((X[jj:jj+1,0:ii,pp].reshape(-1,ii), Ylag[jj:jj+1,0].reshape(-1,1)), axis=1)
-                            Fit_valAR[jj-skip:jj+1-skip,ii-1,pp] = ModelAR.predict(Xpred).T
+                            RegDatXAR = np.concatenate((X[lo:jj,0:ii,pp].reshape(-1,ii), Ylag[lo:jj,0].reshape(-1,1)), axis=1)
+                            ModelAR = LinearRegression().fit(RegDatXAR[~np.isnan(RegDatX).any(axis=1),0:].reshape(-1,ii+1), RegDatY[~np.isnan(RegDatXAR).any(axis=1),0])
+                            if np.isnan(X[jj:jj+1,0:ii,pp]).any():
+                                Fit_valAR[jj-skip:jj+1-skip,ii-1,pp] = np.nan
+                            else:
+                                Xpred = np.concatenate((X[jj:jj+1,0:ii,pp].reshape(-1,ii), Ylag[jj:jj+1,0].reshape(-1,1)), axis=1)
+                                Fit_valAR[jj-skip:jj+1-skip,ii-1,pp] = ModelAR.predict(Xpred).T
                         
                 RMSE[pp,ii-1] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_val[0:len(Y)-skip,ii-1,pp]))) # don't include no data but
                 RMSEAR[pp,ii-1] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_valAR[0:len(Y)-skip,ii-1,pp]))) # don't include no data but
@@ -164,16 +262,23 @@ class OptimMonthly:
                 self.BestAR = RMSE.argmin(axis=1)
                 self.OptimRMSE = RMSE[[0,1,2], [self.BestAR[0],self.BestAR[1],self.BestAR[2]]]
                 
+        self.RMSE, self.RMSEAR = RMSE, RMSEAR
+        self.Fit_val, self.Fit_valAR = Fit_val, Fit_valAR
         self.OptimFit = np.zeros(shape=(len(Fit_val),3))        
+        self.OptimModel = [None]*3 # (lags, Ylag included) of the chosen model in each month
         for ii in range(0,3):
             if RMSE[ii, BestnoAR[ii]]< RMSEAR[ii, BestAR[ii]]:
                 self.OptimFit[0:,ii] = Fit_val[:,BestnoAR[ii],ii]
                 self.BestAR[ii] = BestnoAR[ii]
                 self.OptimRMSE[ii] = RMSE[ii, BestnoAR[ii]]
+                self.OptimModel[ii] = ((BestnoAR[ii]+1,), False)
             else:
                 self.OptimFit[0:,ii] = Fit_valAR[:, BestAR[ii],ii]
                 self.BestAR[ii] = BestnoAR[ii]
                 self.OptimRMSE[ii] = RMSEAR[ii, BestAR[ii]]
+                self.OptimModel[ii] = ((BestAR[ii]+1,), True)
+        windows = range(skip, min(len(X)-1, len(Y))+1) # windows fitted, each for every lag length with and without Ylag
+        self.Counters = StageCounters(start_time, 3*2*maxlag*len(windows), 3*2*maxlag*sum(jj-WindowStart(jj, window) for jj in windows), X, Fit_val, Fit_valAR)
 
 # class OptimMonthlyMulti:
 #     def __init__(self, GDP, monthly):
@@ -260,75 +365,107 @@ class OptimMonthlyMultiDiff:
         self.monthly = monthly
 
     # Single variable assessment
-    def Forecastperf(self, skip, maxlag):
+    def Forecastperf(self, skip, maxlag, n_jobs = 1, search = 'exhaustive', budget = None, beamwidth = 3, X = None, engine = 'gram', storage = 'float64', memory = None, topk = 5, prune = False, window = None):
+        # engine = 'gram' solves every model from cached cumulative cross products (GramCache), 'sklearn' refits every model (reference)
+        # n_jobs > 1 (or -1 for all cores) evaluates chunks of the lag combinations on a process pool
+        # search = 'exhaustive' tries every combination, 'greedy', 'beam' or 'coordinate' search the lags of each variable (see LagSearch)
+        # with at most budget combinations evaluated
+        # X = store of regressors from LagTensor if already built
+        # storage = 'float64', 'float32' or 'mmap' (float32 in a temporary memory mapped file) for Fit_val and Fit_valAR (see TensorStore),
+        # 'auto' float32 if it fits in memory, mmap if not. memory = budget in bytes: the combinations are evaluated in chunks
+        # small enough to fit in it (down to one at a time, the Gram caches themselves have to fit: one per process with n_jobs > 1,
+        # plus the shared memory copy of X and, for each chunk, the workers' parts of its fits until they are joined),
+        # and self.Counters reports the peak bytes held across the processes
+        # storage = 'topk' keeps the RMSE of every combination but the fitted paths of only the topk best in each month, with and
+        # without the AR term (see TopKStore): Fit_val and Fit_valAR are then quarter x topk x month, best first, and
+        # TopCombos, TopCombosAR give the index in Combinations of each column
+        # prune = True abandons a combination as soon as its running out of sample squared error is above the best complete one
+        # (branch and bound, exhaustive search with the gram engine). The chosen models are the same; abandoned combinations get
+        # RMSE inf and NaN fits, and self.Counters reports how many were abandoned and the share of windows skipped
+        # window = estimate on rolling windows of the last window quarters, expanding windows if None
+        start_time = time.perf_counter()
         self.skip = skip
         self.maxlag = maxlag
+        self.window = window
         combovars = self.monthly.shape[1];
-        monthly = self.monthly[0:,:]
-        length = np.int(np.ceil(len(monthly)/3))
-        monthly = np.append(monthly, np.full((length*3-len(monthly),combovars),np.nan),axis=0) # fill remainder of monthly with NaN
-        startq = np.int(np.ceil(maxlag/3)) # to match indexing convention
+        startq = int(np.ceil(maxlag/3)) # to match indexing convention
         GDP = self.GDP[startq:,0:] # allow space for lagged monthly data
         GDPlag = self.GDP[startq-1:,0:]
-        X = np.zeros(shape=(length-startq,maxlag+1,3, combovars))
         # create various lag lengths
         # X time, lag, month (month 1, 2, 3), i.e. Jan, Feb, March in Q1
         ###########################
         # Make store of regressors X (quarter, monthly data up to max lag, month of quarter) - make lags for each variable
-        for jj in range(0,3):
-            for ii in range(0,maxlag+1):
-                for xx in range(0, monthly.shape[1]):
-                    X[0:,ii,jj, xx] = monthly[startq*3-ii+jj:len(monthly)-ii+jj:3, xx].T # every third element for each lag 
-                    
+        if X is None:
+            X = LagTensor(self.monthly, maxlag)
                     
-        # Get iterable of all possible combinations of lags of each variable as a list
-        combinations  = list(iter.combinations_with_replacement(range(1,maxlag), combovars))
-        ncombos = len(combinations)
-         
         # Get taget quarterly variable into correct form.
         Y = GDP.reshape(-1,1)
         Ylag = GDPlag.reshape(-1,1)
         
-        # create fitted values and test RMSE
+        # size of the search, memory taken by the Gram cache and per combination, and chunk size for the memory budget
+        ncombos = SearchSize(combovars, maxlag, None if search == 'exhaustive' else budget)
+        rows = len(X)-skip
+        fixed = GramCache.Estimate(X, Y, window)*NumJobs(n_jobs) if engine == 'gram' else 0 # each pool worker builds its own
+        fixed += X.nbytes if NumJobs(n_jobs) > 1 else 0 # X copied into shared memory for the pool
+        # fits with and without Ylag of each combination in a chunk, twice with a pool (the workers' parts and the joined chunk)
+        per = 2*TensorStore.Bytes('float64', rows)*(2 if NumJobs(n_jobs) > 1 else 1)
+        if storage == 'auto':
+            storage = 'float32' if memory is None or fixed + 2*ncombos*TensorStore.Bytes('float32', rows) + per <= memory else 'mmap'
+        held = 2*topk*TensorStore.Bytes('float64', rows) if storage == 'topk' else 2*ncombos*TensorStore.Bytes(storage, rows) # both stores once full
+        if memory is not None and fixed + held + per > memory:
+            hint = "try storage = 'mmap' or 'topk'" if storage != 'topk' else 'try a larger memory or a smaller topk' + (' or n_jobs = 1' if NumJobs(n_jobs) > 1 else '')
+            raise ValueError('memory = %d bytes is too small for the Gram cache, the %s stores and one combination at a time (%d bytes), %s'
+                             % (memory, storage, fixed + held + per, hint))
+        chunk = None if memory is None else min(max(1, ncombos), int((memory - fixed - held)//per))
+        if storage == 'topk' and chunk is None:
+            chunk = 256 # streamed in any case, so the fits of all combinations are never held at once
+        if engine not in ('gram', 'sklearn'):
+            raise ValueError("engine must be 'gram' or 'sklearn'")
+        if prune and (search != 'exhaustive' or engine != 'gram'):
+            raise ValueError("prune needs search = 'exhaustive' and engine = 'gram'")
+        Bound = np.full(3, np.inf) if prune else None # best squared error so far in each month
+        Work = [0]
+        # keyed once here rather than for every chunk (the pool's workers build their own)
+        Cache = GetGramCache(X, Y, Ylag) if engine == 'gram' and NumJobs(n_jobs) == 1 else None
         
-        Fit_val = np.zeros(shape=(length-skip-startq,ncombos,3))
-        RMSE = np.zeros(shape=(3,ncombos))
-        Fit_valAR = np.zeros(shape=(length-skip-startq,ncombos,3))
-        RMSEAR = np.zeros(shape=(3,ncombos))
+        # create fitted values and test RMSE, chunks of the combinations go to a process pool if n_jobs > 1
+        Batches, Peak = [], [0]
+        if storage == 'topk':
+            StoreFit, StoreFitAR = TopKStore(rows, topk), TopKStore(rows, topk)
+        else:
+            StoreFit, StoreFitAR = TensorStore(storage, rows, ncombos if search == 'exhaustive' else None), TensorStore(storage, rows, ncombos if search == 'exhaustive' else None)
+        def Evaluate(combinations):
+            Best = []
+            for start in range(0, len(combinations), chunk or max(len(combinations), 1)):
+                Part = combinations[start:start+chunk] if chunk else combinations
+                Fits, FitsAR, RMSEpart, RMSEARpart, Windows = EvaluateCombos(X, Y, Ylag, Part, skip, Pool, n_jobs, engine, Bound, window, Cache)
+                Work[0] += Windows.sum()
+                if prune:
+                    # completed models of the chunk (the pool's workers each lowered a copy)
+                    Bound[0:] = np.fmin(Bound, np.square(np.fmin(RMSEpart, RMSEARpart).min(axis=1))*(len(Y)-skip))
+                Peak[0] = max(Peak[0], fixed + StoreFit.nbytes + StoreFitAR.nbytes + (Fits.nbytes + FitsAR.nbytes)*(2 if Pool is not None else 1))
+                StoreFit.Append(Fits, RMSEpart)
+                StoreFitAR.Append(FitsAR, RMSEARpart)
+                Batches.append((Part, RMSEpart, RMSEARpart))
+                Best.append(np.fmin(RMSEpart, RMSEARpart)) # best of with and without AR term
+            return np.concatenate(Best, axis=1)
         
-        #Model = [[None for col in range(maxlag)] for row in range(3)] # holds latest monthxlag regression
-        for pp in range(0,3): # Months
-            for ii in range(0,ncombos): # Up to maxlag
-                for jj in range(skip, len(X)): 
-                    if jj<=len(Y):
-                        # Exclude nan values if early series data not available
-#                        RegDatX, RegDatY = X[0:jj,0:ii,pp,0:].reshape(-1,ii*(combovars-1)), Y[0:jj,0].reshape(-1,1)
-                        RegDatX = X[0:jj,0:combinations[ii][0],pp,0].reshape(-1,combinations[ii][0])
-                        for xx in range(1,combovars):
-                            RegDatX = np.concatenate((RegDatX, X[0:jj,0:combinations[ii][xx],pp,xx]), axis=1)
-                        RegDatY = Y[0:jj,0].reshape(-1,1)
-                        Model = LinearRegression().fit(RegDatX[~np.isnan(RegDatX).any(axis=1),0:], RegDatY[~np.isnan(RegDatX).any(axis=1),0])
-                        if jj==len(X)-1 and ii==ncombos-1:
-                            printcheckthisout = 1
-                        if np.isnan(X[jj:jj+1,0,pp,0:]).any(): # If any variables in the combo model are nan then do not nowcast with this model
-                            Fit_val[jj-skip:jj+1-skip,ii,pp] = np.nan
-                        else:
-                            predX = X[jj:jj+1,0:combinations[ii][0],pp,0].reshape(-1,combinations[ii][0])
-                            for xx in range(1,combovars):
-                                predX = np.concatenate((predX, X[jj:jj+1,0:combinations[ii][xx],pp,xx].reshape(-1,combinations[ii][xx])), axis=1)
-                            Fit_val[jj-skip:jj+1-skip,ii,pp] = Model.predict(predX).T
-                            
-                        RegDatXAR = np.concatenate((RegDatX, Ylag[0:jj,0].reshape(-1,1)), axis=1)
-                        ModelAR = LinearRegression().fit(RegDatXAR[~np.isnan(RegDatX).any(axis=1),0:], RegDatY[~np.isnan(RegDatXAR).any(axis=1),0])
-                        if np.isnan(X[jj:jj+1,0,pp,0:]).any():
-                            Fit_valAR[jj-skip:jj+1-skip,ii,pp] = np.nan
-                        else:
-                            Xpred = np.concatenate((predX, Ylag[jj:jj+1,0].reshape(-1,1)), axis=1)
-                            Fit_valAR[jj-skip:jj+1-skip,ii,pp] = ModelAR.predict(Xpred).T
-                        
-                RMSE[pp,ii] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_val[0:len(Y)-skip,ii,pp]))) # don't include no data but
-                RMSEAR[pp,ii] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_valAR[0:len(Y)-skip,ii,pp]))) # don't include no data but
-                
+        with SharedPool({'X': X}, {'Y': Y, 'Ylag': Ylag, 'skip': skip, 'engine': engine, 'window': window}, n_jobs) if NumJobs(n_jobs) > 1 else contextlib.nullcontext() as Pool:
+            if search == 'exhaustive':
+                # Get iterable of all possible combinations of lags of each variable as a list
+                Evaluate(list(iter.combinations_with_replacement(range(1,maxlag), combovars)))
+            else:
+                LagSearch(Evaluate, combovars, maxlag, search, budget, beamwidth)
+        combinations = [combo for Batch in Batches for combo in Batch[0]]
+        Fit_val, Fit_valAR = StoreFit.Array(), StoreFitAR.Array()
+        Peak[0] = max(Peak[0], fixed + StoreFit.nbytes + StoreFitAR.nbytes)
+        RMSE, RMSEAR = np.concatenate([Batch[1] for Batch in Batches], axis=1), np.concatenate([Batch[2] for Batch in Batches], axis=1)
+        self.Combinations, self.Evaluated = combinations, len(combinations) # candidates tried
+        self.Fit_val, self.Fit_valAR = Fit_val, Fit_valAR
+        self.RMSE, self.RMSEAR = RMSE, RMSEAR
+        if storage == 'topk':
+            self.TopCombos, self.TopCombosAR = StoreFit.Index, StoreFitAR.Index
+
         BestnoAR = RMSE.argmin(axis=1)
         BestAR = RMSEAR.argmin(axis=1)
         self.BestAR = RMSE.argmin(axis=1)
@@ -336,20 +473,33 @@ class OptimMonthlyMultiDiff:
                 
         self.OptimFit = np.zeros(shape=(len(Fit_val),3))       
         self.MultiLags = [0]*3 ;      
+        self.OptimModel = [None]*3 # (lags, Ylag included) of the chosen model in each month
         for ii in range(0,3):
             if RMSE[ii, BestnoAR[ii]]< RMSEAR[ii, BestAR[ii]]:
-                self.OptimFit[0:,ii] = Fit_val[:,BestnoAR[ii],ii]
+                self.OptimFit[0:,ii] = Fit_val[:,BestnoAR[ii] if storage != 'topk' else 0,ii]
                 self.BestAR[ii] = BestnoAR[ii]
                 self.MultiLags[ii] = combinations[BestnoAR[ii]]
                 self.OptimRMSE[ii] = RMSE[ii, BestnoAR[ii]]
+                self.OptimModel[ii] = (combinations[BestnoAR[ii]], False)
             else:
-                self.OptimFit[0:,ii] = Fit_valAR[:, BestAR[ii],ii]
+                self.OptimFit[0:,ii] = Fit_valAR[:, BestAR[ii] if storage != 'topk' else 0,ii]
                 self.BestAR[ii] = BestAR[ii]
                 self.MultiLags[ii] = combinations[BestAR[ii]]
                 self.OptimRMSE[ii] = RMSEAR[ii, BestAR[ii]]
+                self.OptimModel[ii] = (combinations[BestAR[ii]], True)
+            if storage in ('float32', 'mmap'):
+                # chosen models refitted in float64, so the nowcasts don't carry the rounding of the stored fits
+                stop = min(len(X)-1, len(Y))
+                self.OptimFit[0:stop+1-skip,ii] = ModelBacktest(X, Y, Ylag, self.OptimModel[ii][0], ii, self.OptimModel[ii][1], skip, stop, window)
+        windows = range(skip, min(len(X)-1, len(Y))+1) # windows fitted, each for every combination with and without Ylag
+        self.Counters = StageCounters(start_time, 3*2*len(combinations)*len(windows), 3*2*len(combinations)*sum(jj-WindowStart(jj, window) for jj in windows), X, Fit_val, Fit_valAR)
+        self.Counters.update(combinations = len(combinations), storage = storage, chunk = chunk or len(combinations), peakbytes = Peak[0], maxrss = MaxRSS())
+        if prune:
+            self.Counters.update(pruned = int(np.isinf(RMSE).sum() + np.isinf(RMSEAR).sum()), skipped = 1 - Work[0]/max(1, 3*2*len(combinations)*len(windows)))
 
         # find best lag for each month for AR and no AR - then choose best between AR and no AR.
         
+    # needs: from statsmodels.tsa.arima.model import ARIMA
     # def ForecastperfARIMA(self, skip, maxlag):
     #     self.skip = skip
     #     self.maxlag = maxlag
@@ -401,22 +551,22 @@ class OptimMonthlyMultiDiff:
     def PlotBest(self):
         Y = self.GDP
         maxlag = self.maxlag 
-        startq = np.int(np.ceil(maxlag/3))
+        startq = int(np.ceil(maxlag/3))
         Y = Y[startq+self.skip:]
         Y_fit = self.Fit_val[0:,0:,0:]
-        fig2 = plt.figure(figsize=(15,15))
+        # fit of the best combination in each month (only the chosen model's fit is kept with storage = 'topk')
+        Best = [Y_fit[0:,self.BestAR[num],num] if not hasattr(self, 'TopCombos') else self.OptimFit[0:,num] for num in range(0,3)]
         title = ['Month 1', 'Month 2', 'Month 3']
-        for num, tt in zip(range(0,3), title):
-            ax1 = fig2.add_subplot(3,1,num+1)
-            ax1.plot(range(0,len(Y)), Y,marker='', color='olive', linewidth=2)
-            ax1.plot(range(0,len(Y_fit)), Y_fit[0:,self.BestAR[num],num], marker='', color='blue', linewidth=2)
-            ax1.legend(['GDP', 'fitted'], loc='upper left')
-            ax1.set_title(tt)
-        plt.show()      
+        ShowChart({'name': 'OptimMonthlyMultiDiff', 'panels': [{'title': tt, 'legend': ['GDP', 'fitted'], 'lines': [(range(0,len(Y)), Y, '', 'olive'), (range(0,len(Y_fit)), Best[num], '', 'blue')]}
+                                                              for num, tt in zip(range(0,3), title)]})
 
         
 class ForecastCombine:
-    def __init__(self, GDP, monthlyseries, skip, ARt, maxlag , ARinclude, weighttype, names, MultiModel = []):
+    def __init__(self, GDP, monthlyseries, skip, ARt, maxlag , ARinclude, weighttype, names, MultiModel = [], n_jobs = 1, MultiSearch = 'exhaustive', MultiBudget = None, cachedir = None, profile = None, schemes = (), storage = 'float64', memory = None, MultiPrune = False, window = None, select = 'oos'):
+        # n_jobs > 1 (or -1 for all cores) runs the indicator backtests on a process pool
+        # MultiSearch, MultiBudget = search strategy and maximum number of lag combinations tried for the MultiModel (see LagSearch)
+        # cachedir = directory to keep the AR, indicator and MultiModel backtests in (ResultCache), reused when their data and settings are unchanged
+        # profile = Profiler to record the time and counters of each stage in
         self.GDP = GDP
         self.monthlyseries = monthlyseries
         self.skip = skip
@@ -425,25 +575,42 @@ class ForecastCombine:
         self.names = names
         self.ARinclude = ARinclude
         self.weighttype = weighttype
+        self.schemes = list(schemes) # other combination schemes to compare, kept in self.Combinations (see SchemeWeights)
+        self.storage, self.memory = storage, memory # storage of the MultiModel backtests and memory budget (see OptimMonthlyMultiDiff.Forecastperf)
+        self.MultiPrune = MultiPrune # abandon losing MultiModel lag combinations early (branch and bound, exhaustive search only)
+        self.window = window # rolling estimation windows of this many quarters in every backtest, expanding windows if None
+        self.select = select # lags of each indicator chosen on out of sample RMSE ('oos') or pre-selected in sample ('press', 'aic', 'bic')
         if MultiModel:
             self.MultiModel = MultiModel
         else:
             self.MultiModel = []
+        self.n_jobs = n_jobs
+        self.MultiSearch = MultiSearch
+        self.MultiBudget = MultiBudget
+        self.cachedir = cachedir
+        self.profile = profile
         
     def Optimize(self):
         # Get optimal AR structure
         # time process
         start_time = time.time()
-        GDPfitted = OptimARoos(GDP = self.GDP)
-        GDPfitted.Forecastperf(ARt = self.ARt, skip = self.skip)
+        del self.names[len(self.monthlyseries):] # drop 'AR' and 'MultiModel' added by an earlier run
+        Memo = ResultCache(self.cachedir) if self.cachedir else None
+        def FitAR():
+            Temp = OptimARoos(GDP = self.GDP)
+            Temp.Forecastperf(ARt = self.ARt, skip = self.skip, window = self.window)
+            return Temp
+        with self.Stage('AR') as Counters:
+            GDPfitted = Memoized(Memo, ArrayKey(self.GDP, model = 'OptimARoos', ARt = self.ARt, skip = self.skip, window = self.window), FitAR)
+            Counters.update(getattr(GDPfitted, 'Counters', {}), seconds = None)
         ARfit = GDPfitted.OptimFit
         ARRMSE = GDPfitted.OptimRMSE
         ARlag = GDPfitted.BestAR
-        if self.ARt>np.int(np.ceil(self.maxlag/3)):
-            self.addiskip = self.ARt-np.int(np.ceil(self.maxlag/3)) # how many periods to skip in sample due to lags on AR1 and monthly
+        if self.ARt>int(np.ceil(self.maxlag/3)):
+            self.addiskip = self.ARt-int(np.ceil(self.maxlag/3)) # how many periods to skip in sample due to lags on AR1 and monthly
         else:
             self.addiskip = 0
-        size = len(self.GDP)-(np.int(np.ceil(self.maxlag/3))+self.skip+self.addiskip)
+        size = len(self.GDP)-(int(np.ceil(self.maxlag/3))+self.skip+self.addiskip)
         Month1 = np.zeros(shape=(size+1,len(self.monthlyseries))) # additional row for forecast
         Month2 = np.zeros(shape=(size+1,len(self.monthlyseries)))
         Month3 = np.zeros(shape=(size+1,len(self.monthlyseries)))
@@ -454,12 +621,30 @@ class ForecastCombine:
         Month2lag = np.zeros(shape=(1,len(self.monthlyseries)))
         Month3lag = np.zeros(shape=(1,len(self.monthlyseries)))
         
-        for series, jj in zip(self.monthlyseries, range(0, len(self.monthlyseries))):
-            Temp = OptimMonthly(GDP = self.GDP[self.addiskip:], monthly = series[self.addiskip*3:])
-            Temp.Forecastperf(skip=self.skip, maxlag = self.maxlag)
+        # padded monthly panel and its lag store, built once and shared by every backtest
+        Panel = MonthlyPanel([series[self.addiskip*3:] for series in self.monthlyseries])
+        LagStore = LagTensor(Panel, self.maxlag)
+        # only the indicators whose data or settings changed since they were cached are backtested
+        Keys = [ArrayKey(self.GDP[self.addiskip:], Panel[0:,jj], model = 'OptimMonthly', skip = self.skip, maxlag = self.maxlag, window = self.window, select = self.select) for jj in range(0, Panel.shape[1])]
+        Backtests = [Memo.Get(key) if Memo is not None else None for key in Keys]
+        Todo = [jj for jj in range(0, Panel.shape[1]) if Backtests[jj] is None]
+        with self.Stage('indicators') as Counters:
+            if Todo:
+                Sub = slice(None) if len(Todo) == Panel.shape[1] else Todo
+                for jj, Temp in zip(Todo, MonthlyBacktests(GDP = self.GDP[self.addiskip:], Panel = Panel[0:,Sub], skip = self.skip, maxlag = self.maxlag, n_jobs = self.n_jobs, X = LagStore[0:,0:,0:,Sub], window = self.window, select = self.select)):
+                    Backtests[jj] = Temp
+                    if Memo is not None:
+                        Memo.Put(Keys[jj], Temp)
+            Counters.update(computed = len(Todo), cached = Panel.shape[1]-len(Todo), peakbytes = max(LagStore.nbytes, Panel.nbytes))
+        if self.profile is not None:
+            for jj in range(0, Panel.shape[1]): # each indicator, time as measured in the backtest (in the worker if run on a pool)
+                self.profile.Record('OptimMonthly', self.names[jj], cached = jj not in Todo, **getattr(Backtests[jj], 'Counters', {}))
+        Models = [] # (variables, chosen model in each month) of each column of Month1/2/3, kept for Update
+        for Temp, jj in zip(Backtests, range(0, len(self.monthlyseries))):
             Month1[0:,jj], Month2[0:,jj], Month3[0:,jj] = Temp.OptimFit[0:,0], Temp.OptimFit[0:,1], Temp.OptimFit[0:,2]
             Month1_RMSE[0,jj], Month2_RMSE[0,jj], Month3_RMSE[0,jj] = Temp.OptimRMSE[0], Temp.OptimRMSE[1], Temp.OptimRMSE[2]
             Month1lag[0,jj], Month2lag[0,jj], Month3lag[0,jj] = Temp.BestAR[0]+1, Temp.BestAR[1]+1, Temp.BestAR[2]+1
+            Models.append(([jj], Temp.OptimModel))
             
         # Add on AR forecast if needed
         if self.ARinclude:
@@ -467,81 +652,134 @@ class ForecastCombine:
             Month1_RMSE, Month2_RMSE, Month3_RMSE  = np.append(Month1_RMSE, ARRMSE.reshape(-1,1), axis=1), np.append(Month2_RMSE, ARRMSE.reshape(-1,1), axis=1),np.append(Month3_RMSE, ARRMSE.reshape(-1,1), axis=1)
             Month1lag, Month2lag, Month3lag  = np.append(Month1lag, ARlag.reshape((-1,1))+1, axis=1), np.append(Month2lag, ARlag.reshape((-1,1))+1, axis=1), np.append(Month3lag, ARlag.reshape((-1,1))+1, axis=1)
             self.names.append('AR')
+            Models.append(None) # GDP only, not affected by monthly releases
             
         # Add on Combi forecast if needed
 
         
         # Get RMSE_weighted forecast
-        Optimal = np.zeros(shape=(size+1,3))
-        # Use inverse of RMSE or MSE to weight together forecasts
-        if self.weighttype == 'rmse':
-            Optimal[0:,0], Optimal[0:,1], Optimal[0:,2] =  WeightedMeanNaN(Tseries = Month1, weights=np.divide(1,Month1_RMSE)), WeightedMeanNaN(Tseries = Month2, weights=np.divide(1,Month2_RMSE)), WeightedMeanNaN(Tseries = Month3, weights=np.divide(1,Month3_RMSE))
-        elif self.weighttype == 'mse':
-            Optimal[0:,0], Optimal[0:,1], Optimal[0:,2] =  WeightedMeanNaN(Tseries = Month1, weights=np.divide(1,np.square(Month1_RMSE))), WeightedMeanNaN(Tseries = Month2, weights=np.divide(1,np.square(Month2_RMSE))), WeightedMeanNaN(Tseries = Month3, weights=np.divide(1,np.square(Month3_RMSE)))
-       
-        RMSE = np.zeros(shape = (1,3))
-        # Get newly calculated RMSE
-        for ii in range(0,3):
-            RMSE[0,ii] = np.sqrt(np.average(np.square(self.GDP[len(self.GDP)-size:,0]-Optimal[0:-1,ii])))
+        with self.Stage('combination') as Counters:
+            Optimal, RMSE = self.Combine(Month1, Month2, Month3, Month1_RMSE, Month2_RMSE, Month3_RMSE, size)
+            Counters.update(rows = Month1.size*3, peakbytes = Month1.nbytes)
         
         if self.MultiModel:
             # Get only series included in list for multi-indicators model
             idx=np.where(np.isin(self.names, self.MultiModel))
-            arraydata_temp = [] 
-            for i in range(0,len(idx[0])):
-                arraydata_temp.append(self.monthlyseries[idx[0][i]])
-            arraydata = np.concatenate(arraydata_temp, axis=1)
-            #np.asarray([self.monthlyseries[i] for i in idx[0]]).reshape((-1,len(self.MultiModel)))
-            TempMulti = OptimMonthlyMultiDiff(GDP = self.GDP[self.addiskip:], monthly = arraydata[self.addiskip*3:])
-            TempMulti.Forecastperf(skip = self.skip, maxlag = self.maxlag)
+            def FitMulti():
+                Temp = OptimMonthlyMultiDiff(GDP = self.GDP[self.addiskip:], monthly = Panel[0:,idx[0]])
+                Temp.Forecastperf(skip = self.skip, maxlag = self.maxlag, n_jobs = self.n_jobs, search = self.MultiSearch, budget = self.MultiBudget, X = LagStore[0:,0:,0:,idx[0]],
+                                  storage = self.storage, memory = self.memory, prune = self.MultiPrune, window = self.window)
+                return Temp
+            with self.Stage('MultiModel', self.MultiSearch) as Counters:
+                TempMulti = Memoized(Memo, ArrayKey(self.GDP[self.addiskip:], Panel[0:,idx[0]], model = 'OptimMonthlyMultiDiff', skip = self.skip, maxlag = self.maxlag,
+                                                    search = self.MultiSearch, budget = self.MultiBudget, storage = self.storage, prune = self.MultiPrune, window = self.window), FitMulti)
+                Counters.update(getattr(TempMulti, 'Counters', {}), seconds = None)
             # Append results of multimodel onto 
             Month1, Month2, Month3  = np.append(Month1, TempMulti.OptimFit[0:,0].reshape(-1,1), axis=1), np.append(Month2, TempMulti.OptimFit[0:,1].reshape(-1,1), axis=1), np.append(Month3, TempMulti.OptimFit[0:,2].reshape(-1,1), axis=1)
             Month1_RMSE, Month2_RMSE, Month3_RMSE  = np.append(Month1_RMSE, TempMulti.OptimRMSE[0].reshape(-1,1), axis=1), np.append(Month2_RMSE, TempMulti.OptimRMSE[1].reshape(-1,1), axis=1), np.append(Month3_RMSE, TempMulti.OptimRMSE[2].reshape(-1,1), axis=1)
             Month1lag, Month2lag, Month3lag  = np.append(Month1lag, TempMulti.BestAR[0].reshape(-1,1)+1, axis=1), np.append(Month2lag, TempMulti.BestAR[1].reshape(-1,1)+1, axis=1), np.append(Month3lag, TempMulti.BestAR[2].reshape(-1,1)+1, axis=1)
             self.names.append('MultiModel')
+            Models.append((list(idx[0]), TempMulti.OptimModel))
         
         print("--- %s seconds ---" % (time.time() - start_time))
+        if self.profile is not None:
+            self.profile.Record('Optimize', seconds = time.time() - start_time)
         self.RMSEcombined = RMSE
         self.size = size # size of forecast given max lag settings for monthly and ar1
         self.OptimalFit = Optimal
         self.Month1, self.Month2, self.Month3 = Month1, Month2, Month3
         self.Month1_RMSE, self.Month2_RMSE, self.Month3_RMSE = Month1_RMSE, Month2_RMSE, Month3_RMSE
         self.Month1lag, self.Month2lag, self.Month3lag = Month1lag, Month2lag, Month3lag
+        self.Panel, self.LagStore, self.Models = Panel, LagStore, Models
         if self.MultiModel:
             self.MultiLags = TempMulti.MultiLags
+            self.MultiEvaluated = TempMulti.Evaluated
+
+    def Stage(self, stage, name = None):
+        ## context recording a stage in self.profile (if profiling), yields a dict for the stage's counters
+        return self.profile.Stage(stage, name) if self.profile is not None else contextlib.nullcontext({})
+
+    def Combine(self, Month1, Month2, Month3, Month1_RMSE, Month2_RMSE, Month3_RMSE, size):
+        ## weighted combination of the forecasts in each month (weighttype) and its RMSE. The other schemes are combined
+        ## in the same pass and kept in self.Combinations, scheme: (combined forecasts, RMSE)
+        schemes = [self.weighttype] + [scheme for scheme in self.schemes if scheme != self.weighttype]
+        Combined = CombineForecasts(np.stack((Month1, Month2, Month3), axis=2), np.concatenate((Month1_RMSE, Month2_RMSE, Month3_RMSE)).T, schemes)
+        # Get newly calculated RMSE
+        self.Combinations = {scheme: (Optimal, np.sqrt(np.average(np.square(self.GDP[len(self.GDP)-size:] - Optimal[0:-1]), axis=0)).reshape(1,3))
+                             for scheme, Optimal in Combined.items()}
+        return self.Combinations[self.weighttype]
+
+    def Update(self, monthlyseries = None, reselect = False):
+        ## Update the nowcasts for a new release of the monthly data, keeping the lags chosen by the last Optimize
+        ## monthlyseries = new vintage of the monthly series, in the original order (None in place of a series leaves it unchanged)
+        ## Only the windows from the first quarter whose lags changed are refitted, so a release in the nowcast quarter refits one
+        ## window of each affected model. reselect = True (or a release that starts a new quarter) re-runs Optimize in full.
+        ## A new GDP release needs Optimize.
+        start_time = time.time()
+        if monthlyseries is not None:
+            self.monthlyseries = [old if new is None else new for old, new in zip(self.monthlyseries, monthlyseries)]
+        Panel = MonthlyPanel([series[self.addiskip*3:] for series in self.monthlyseries]) if hasattr(self, 'Models') else None
+        if reselect or Panel is None or Panel.shape != self.Panel.shape:
+            self.Optimize()
+            return
+        LagStore = LagTensor(Panel, self.maxlag)
+        Same = (LagStore == self.LagStore) | (np.isnan(LagStore) & np.isnan(self.LagStore))
+        Changed = ~Same.all(axis=(1,2)) # quarter x series
+        startq = int(np.ceil(self.maxlag/3))
+        Y = self.GDP[self.addiskip+startq:,0:]
+        Ylag = self.GDP[self.addiskip+startq-1:,0:]
+        stop = min(len(LagStore)-1, len(Y))
+        Months = (self.Month1, self.Month2, self.Month3)
+        RMSEs = (self.Month1_RMSE, self.Month2_RMSE, self.Month3_RMSE)
+        for Model, kk in zip(self.Models, range(0, len(self.Models))):
+            if Model is None or not Changed[0:,Model[0]].any():
+                continue
+            start = max(self.skip, np.where(Changed[0:,Model[0]].any(axis=1))[0][0]) # first window affected
+            for pp in range(0,3): # Months
+                combo, AR = Model[1][pp]
+                Months[pp][start-self.skip:stop+1-self.skip,kk] = ModelBacktest(LagStore[0:,0:,0:,Model[0]], Y, Ylag, combo, pp, AR, start, stop, self.window)
+                if start < len(Y): # an in-sample quarter changed
+                    RMSEs[pp][0,kk] = np.sqrt(np.average(np.square(Y[self.skip:,0]-Months[pp][0:len(Y)-self.skip,kk])))
+        # combination excludes the MultiModel, as in Optimize
+        ncomb = len(self.Models)-1 if self.MultiModel else len(self.Models)
+        self.OptimalFit, self.RMSEcombined = self.Combine(*[Temp[0:,0:ncomb] for Temp in Months + RMSEs], self.size)
+        self.Panel, self.LagStore = Panel, LagStore
+        print("--- %s seconds ---" % (time.time() - start_time))
         
+    def Nowcast(self):
+        ## nowcast of the latest quarter using the most months of data available, and that month: the last of Month 1-3
+        ## with a forecast from the monthly data (the AR forecast is there in every month)
+        Nowcast = self.OptimalFit[-1]
+        Indicators = [ii for ii, name in enumerate(self.names) if name != 'AR']
+        Available = [pp for pp, Month in zip(range(0,3), (self.Month1, self.Month2, self.Month3)) if ~np.isnan(Nowcast[pp]) and (~np.isnan(Month[-1, Indicators])).any()]
+        return (Nowcast[Available[-1]], Available[-1]+1) if Available else (np.nan, 0)
+
     def PlotBest(self, datetime, Quarterlyname):
-        Y = self.GDP
-        maxlag = self.maxlag 
-        Y = Y[len(Y)-self.size:]
-        Y_fit = self.OptimalFit
-        fignew = plt.figure(figsize=(15,15))
-        title = ['Month 1', 'Month 2', 'Month 3']
-        for num, tt in zip(range(0,3), title):
-            axnew = fignew.add_subplot(3,1,num+1)
-            axnew.plot(datetime[-len(Y)-1:-1], Y,marker='o', color='olive', linewidth=2)
-            axnew.plot(datetime[-len(Y_fit):], Y_fit[0:,num], marker='o', color='blue', linewidth=2)
-            axnew.legend([Quarterlyname, 'fitted'], loc='upper left')
-            axnew.set_title(tt)
-        plt.show()   
+        with self.Stage('reporting', 'PlotBest'):
+            Y = self.GDP
+            maxlag = self.maxlag 
+            Y = Y[len(Y)-self.size:]
+            Y_fit = self.OptimalFit
+            title = ['Month 1', 'Month 2', 'Month 3']
+            ShowChart({'name': Quarterlyname, 'panels': [{'title': tt, 'legend': [Quarterlyname, 'fitted'], 'lines': [(datetime[-len(Y)-1:-1], Y, 'o', 'olive'), (datetime[-len(Y_fit):], Y_fit[0:,num], 'o', 'blue')]}
+                                                         for num, tt in zip(range(0,3), title)]})
         
     def PlotSeries(self, datetime, Quarterlyname):
-        Y = self.GDP
-        maxlag = self.maxlag 
-        Y = Y[len(Y)-self.size:]
-        Y_fit = self.OptimalFit
-        fignew = plt.figure(figsize=(15,15))
-        title = ['Month 1', 'Month 2', 'Month 3']
-        for num, tt in zip(range(0,3), title):
-            axnew = fignew.add_subplot(3,1,num+1)
-            axnew.plot(datetime[-len(Y)-1:-1], Y,marker='o', color='olive', linewidth=2)
-            axnew.plot(datetime[-len(Y_fit):], Y_fit[0:,num], marker='o', color='blue', linewidth=2)
-            axnew.legend([Quarterlyname, 'fitted'], loc='upper left')
-            axnew.set_title(tt)
-        plt.show()  
+        with self.Stage('reporting', 'PlotSeries'):
+            Y = self.GDP
+            maxlag = self.maxlag 
+            Y = Y[len(Y)-self.size:]
+            Y_fit = self.OptimalFit
+            title = ['Month 1', 'Month 2', 'Month 3']
+            ShowChart({'name': Quarterlyname, 'panels': [{'title': tt, 'legend': [Quarterlyname, 'fitted'], 'lines': [(datetime[-len(Y)-1:-1], Y, 'o', 'olive'), (datetime[-len(Y_fit):], Y_fit[0:,num], 'o', 'blue')]}
+                                                         for num, tt in zip(range(0,3), title)]})
         
         
     def PrintNiceOutput(self, datetime):
+        with self.Stage('reporting', 'PrintNiceOutput'):
+            self.PrintTables(datetime)
+
+    def PrintTables(self, datetime):
         # Print optimal fit figures
         Qoffcast = datetime[-1].strftime('%d-%b-%Y')
         titlefit = ['Month 1', 'Month 2', 'Month 3']
@@ -553,6 +791,10 @@ class ForecastCombine:
         print('\n')
         print('Optimal forecast RMSEs')
         print(tabulate(np.vstack((titlefit, optimrmses))))
+        if self.schemes:
+            print('\n')
+            print('RMSEs of each combination scheme')
+            print(tabulate([[scheme] + RMSE.flatten().tolist() for scheme, (Optimal, RMSE) in self.Combinations.items()], headers = [''] + titlefit))
         
         print('\n')
         print('Forecast of each indicator in each month')
@@ -609,39 +851,963 @@ class ForecastCombine:
 
         
 def WeightedMeanNaN(Tseries, weights):
-    ## calculates weighted mean 
-    N_Tseries = Tseries.copy()
-    Weights = np.repeat(weights, len(N_Tseries), axis=0) # make a vector of weights matching size of time series
-    loc = np.where(np.isnan(N_Tseries)) # get location of nans
-    Weights[loc] = 0
-    N_Tseries[loc] = 0
-    
-    locallmissing = np.where(Weights.sum(axis=1) == 0)
-    Weights[locallmissing, :] = 1 # to stop divide by zero error
-    Weights = Weights/Weights.sum(axis=1)[:,None] # normalize each row so that weights sum to 1
-    WeightedAve = np.multiply(N_Tseries,Weights)
-    WeightedAve = WeightedAve.sum(axis=1)
-    WeightedAve[locallmissing] = np.nan 
-    return WeightedAve
-    
+    ## calculates weighted mean of each row of Tseries, skipping NaNs (NaN if nothing with weight is left)
+    return WeightedCube(Tseries[:,:,None], np.reshape(weights, (1,-1,1)))[0,0:,0]
+
+
+def WeightedCube(Cube, Weights):
+    ## Weighted means over models of a time x model x month cube for a stack of weights (scheme x model x month), skipping
+    ## NaN forecasts: the weights of the models available at each date are renormalized, NaN where none with weight is.
+    ## A NaN weight makes the mean NaN at the dates its model has a forecast. The weights are broadcast, never repeated
+    ## over time. Returns scheme x time x month.
+    Valid = ~np.isnan(Cube)
+    Missing = np.isnan(Weights)
+    Weights = np.where(Missing, 0, Weights)
+    Numerator = np.einsum('tmp,smp->stp', np.where(Valid, Cube, 0), Weights)
+    Denominator = np.einsum('tmp,smp->stp', Valid.astype(float), Weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Mean = np.where(Denominator != 0, Numerator/Denominator, np.nan)
+    if Missing.any():
+        Mean[np.einsum('tmp,smp->stp', Valid.astype(float), Missing.astype(float)) > 0] = np.nan
+    return Mean
+
+
+def SchemeWeights(RMSE, schemes, topk = 3, trim = 0.25):
+    ## Combination weights (scheme x model x month) from the out of sample RMSE of each model in each month (model x month)
+    ## 'rmse' inverse RMSE, 'mse' inverse MSE, 'equal' equal weights, 'rank' inverse of the RMSE rank (best = 1),
+    ## 'topk' equal weights on the topk lowest RMSEs, 'trimmed' equal weights after dropping the worst trim share.
+    ## As in the original inverse RMSE/MSE weighting a NaN RMSE gives the 'rmse' and 'mse' combinations a NaN wherever
+    ## that model has a forecast; the other schemes give models without a finite RMSE no weight, with a warning.
+    Dropped = ~np.isfinite(RMSE)
+    if Dropped.any() and set(schemes) - {'rmse', 'mse'}:
+        warnings.warn('models %s have no finite RMSE in some month and get no weight in the %s combinations'
+                      % (list(np.flatnonzero(Dropped.any(axis=1))), ', '.join(sorted(set(schemes) - {'rmse', 'mse'}))))
+    NaN = np.isnan(RMSE)
+    RMSE = np.where(Dropped, np.inf, RMSE)
+    Rank = RMSE.argsort(axis=0).argsort(axis=0) + 1 # 1 = lowest RMSE in the month
+    nmodels = len(RMSE)
+    Weights = np.zeros((len(schemes),) + RMSE.shape)
+    with np.errstate(divide='ignore'):
+        for scheme, ss in zip(schemes, range(0, len(schemes))):
+            if scheme == 'rmse':
+                Weights[ss] = np.where(NaN, np.nan, 1/RMSE)
+            elif scheme == 'mse':
+                Weights[ss] = np.where(NaN, np.nan, 1/np.square(RMSE))
+            elif scheme == 'equal':
+                Weights[ss] = 1
+            elif scheme == 'rank':
+                Weights[ss] = 1/Rank
+            elif scheme == 'topk':
+                Weights[ss] = Rank <= topk
+            elif scheme == 'trimmed':
+                Weights[ss] = Rank <= max(1, nmodels - int(np.floor(trim*nmodels)))
+            else:
+                raise ValueError('unknown combination scheme ' + str(scheme))
+            if scheme not in ('rmse', 'mse'):
+                Weights[ss][Dropped] = 0
+    return Weights
+
+
+def CombineForecasts(Cube, RMSE, schemes = ('mse',), topk = 3, trim = 0.25):
+    ## Combine the forecasts of a time x model x month cube with each scheme (see SchemeWeights) in one pass.
+    ## Returns {scheme: time x month combined forecasts}
+    Combined = WeightedCube(Cube, SchemeWeights(RMSE, schemes, topk = topk, trim = trim))
+    return dict(zip(schemes, Combined))
+
+
+def FitOLS(X, Y):
+    ## OLS with intercept, same solution as LinearRegression().fit (centred least squares, minimum norm if rank deficient)
+    ## returns [intercept, coefficients]
+    Xmean, Ymean = X.mean(axis=0), Y.mean()
+    Coef = np.linalg.lstsq(X-Xmean, Y-Ymean, rcond=np.finfo(float).eps)[0]
+    return np.concatenate(([Ymean-Xmean @ Coef], Coef))
+
+
+Criteria = ('rmse', 'press', 'aic', 'bic') # in-sample selection scores (see SelectionScores)
+
+
+def SelectionScores(X, Y):
+    ## In-sample scores of the OLS fit of Y on X (with intercept) from one QR factorization, rows with a missing value dropped:
+    ## 'rmse' in-sample RMSE, 'press' leave-one-out RMSE (residuals scaled by 1 - hat matrix diagonal), 'aic' and 'bic'
+    ## inf if there are too few rows or the design is rank deficient, so the model is never chosen
+    X = X.reshape(len(X),-1)
+    Rows = ~np.isnan(X).any(axis=1) & ~np.isnan(Y)
+    Z = np.concatenate((np.ones(shape=(Rows.sum(),1)), X[Rows]), axis=1)
+    n, k = Z.shape
+    if n <= k:
+        return dict.fromkeys(Criteria, np.inf)
+    Q, R = np.linalg.qr(Z)
+    if np.abs(np.diag(R)).min() <= n*np.finfo(float).eps*np.abs(np.diag(R)).max():
+        return dict.fromkeys(Criteria, np.inf)
+    Resid = Y[Rows] - Q @ (Q.T @ Y[Rows])
+    Hat = np.einsum('ij,ij->i', Q, Q)
+    SSE = Resid @ Resid
+    with np.errstate(divide='ignore'):
+        PRESS = np.sum(np.square(Resid/(1-Hat))) if Hat.max() < 1-1e-12 else np.inf
+        LogL = n*np.log(SSE/n)
+    return {'rmse': np.sqrt(SSE/n), 'press': np.sqrt(PRESS/n), 'aic': LogL + 2*k, 'bic': LogL + k*np.log(n)}
+
+
+def WindowStart(jj, window = None):
+    ## first row of the estimation window for row jj: 0 for expanding windows 0:jj, jj-window for rolling windows of window rows
+    return 0 if window is None else np.maximum(0, np.asarray(jj)-window)
+
+
+def RecursiveLS(X, Y, start, stop=None, window=None):
+    ## Expanding window OLS (with intercept) by rank-one recursive least squares
+    ## row jj-start of the output holds [intercept, coefficients] fitted on X[0:jj], Y[0:jj] for jj = start..stop
+    ## window = rolling windows of that many rows, X[jj-window:jj], the oldest row taken out as each new one is added
+    if stop is None:
+        stop = len(X)
+    Z = np.concatenate((np.ones(shape=(len(X),1)), X.reshape(len(X),-1)), axis=1)
+    Coefs = np.zeros(shape=(stop-start+1, Z.shape[1]))
+    P = None
+    for jj in range(start, stop+1):
+        lo = WindowStart(jj, window)
+        if P is None:
+            # initialise from the first window with a full rank design, exact (sklearn) solve until then
+            Coefs[jj-start] = FitOLS(Z[lo:jj,1:], Y[lo:jj])
+            if jj-lo >= Z.shape[1] and np.linalg.matrix_rank(Z[lo:jj]) == Z.shape[1]:
+                P = np.linalg.inv(Z[lo:jj].T @ Z[lo:jj])
+                Beta = Coefs[jj-start].copy()
+            continue
+        # add observation jj-1 to the window (Sherman-Morrison update of inverse cross-product matrix)
+        z = Z[jj-1]
+        Pz = P @ z
+        Gain = Pz/(1 + z @ Pz)
+        Beta = Beta + Gain*(Y[jj-1] - z @ Beta)
+        P = P - np.outer(Gain, Pz)
+        if lo > WindowStart(jj-1, window):
+            # take observation lo-1 out of the window (downdate), back to an exact solve if that leaves the design near singular
+            z = Z[lo-1]
+            Pz = P @ z
+            if 1 - z @ Pz < 1e-8:
+                P = None
+                Coefs[jj-start] = FitOLS(Z[lo:jj,1:], Y[lo:jj])
+                continue
+            Gain = Pz/(1 - z @ Pz)
+            Beta = Beta - Gain*(Y[lo-1] - z @ Beta)
+            P = P + np.outer(Gain, Pz)
+        Coefs[jj-start] = Beta
+    return Coefs
+
+
+def OrderRecursiveOLS(X, Y, Ylag, skip, stop, window = None):
+    ## Expanding window out of sample fits of Y on every lag prefix X[:,0:ii] (ii = 1..X.shape[1]), without and with Ylag
+    ## row jj-skip of the outputs is the prediction for X[jj] from the fit on rows 0:jj, jj = skip..stop
+    ## window = rolling windows jj-window:jj instead, their cross products the difference of two cumulative sums
+    ## Rows with missing lags are dropped per prefix and the prediction is NaN if X[jj,0:ii] is missing (as in OptimMonthly)
+    ## With regressors Z = [1, X] and Z'Z = LL' (L lower triangular) the prediction of every prefix model at z is
+    ## cumsum((L^-1 z)*(L^-1 Z'Y)), so one Cholesky per window gives all lag lengths. Same again with Z = [1, Ylag, X].
+    nlag = X.shape[1]
+    X = X[0:stop+1]
+    Fit = np.zeros(shape=(stop-skip+1,nlag))
+    FitAR = np.zeros(shape=(stop-skip+1,nlag))
+    Valid = ~np.isnan(X)
+    Depth = np.where(Valid.all(axis=1), nlag, Valid.argmin(axis=1)) # number of leading non-missing lags in each row
+    Z = np.concatenate((np.ones(shape=(len(X),1)), np.where(Valid, X, 0), Ylag[0:len(X)].reshape(-1,1)), axis=1)
+    Colsets = ([0] + list(range(1,nlag+1)), [0, nlag+1] + list(range(1,nlag+1))) # [1, X] and [1, Ylag, X]
+    # cumulative cross products of rows with at least ii leading lags, Gram[ii-1,n] sums rows 0:n
+    Keep = (Depth[None,0:stop] >= np.arange(1,nlag+1)[:,None]).astype(float)
+    Gram = np.zeros(shape=(nlag,stop+1,nlag+2,nlag+2))
+    Gram[:,1:] = np.cumsum(Keep[:,:,None,None]*(Z[0:stop,:,None]*Z[0:stop,None,:])[None], axis=1)
+    ZY = np.zeros(shape=(nlag,stop+1,nlag+2))
+    ZY[:,1:] = np.cumsum(Keep[:,:,None]*(Z[0:stop]*Y[0:stop,None])[None], axis=1)
+    Nrows = np.concatenate((np.zeros(shape=(nlag,1)), np.cumsum(Keep, axis=1)), axis=1)
+    for jj in range(skip, stop+1):
+        lo = WindowStart(jj, window)
+        G, R, N = Gram[:,jj] - Gram[:,lo], ZY[:,jj] - ZY[:,lo], Nrows[:,jj] - Nrows[:,lo] # rows lo:jj
+        ii = 1
+        while ii <= nlag:
+            # lag lengths ii..last share the same estimation rows, so share one factorization
+            last = ii
+            while last < nlag and N[last] == N[ii-1]:
+                last += 1
+            for Out, cols, offset in zip((Fit, FitAR), Colsets, (0, 1)):
+                cols = cols[0:last+1+offset]
+                try:
+                    if N[ii-1] < len(cols):
+                        raise np.linalg.LinAlgError
+                    L = np.linalg.cholesky(G[ii-1][np.ix_(cols,cols)])
+                    W = np.linalg.solve(L, np.stack((Z[jj,cols], R[ii-1,cols]), axis=1))
+                    Out[jj-skip,ii-1:last] = np.cumsum(W[:,0]*W[:,1])[ii+offset:last+1+offset]
+                except np.linalg.LinAlgError:
+                    # too few rows or collinear, solve each lag length exactly
+                    for kk in range(ii, last+1):
+                        Rows, Sub = Depth[lo:jj] >= kk, sorted(cols[1:kk+1+offset]) # regressors in the order [X, Ylag]
+                        Coefs = FitOLS(Z[lo:jj][Rows][:,Sub], Y[lo:jj][Rows])
+                        Out[jj-skip,kk-1] = Coefs[0] + Z[jj,Sub] @ Coefs[1:]
+            ii = last+1
+        # no nowcast when the lags in the nowcast quarter are missing
+        Fit[jj-skip,Depth[jj]:], FitAR[jj-skip,Depth[jj]:] = np.nan, np.nan
+    return Fit, FitAR
+
+
+class GramCache:
+    ## Cumulative cross products of the multi-indicator regressors Z = [1, lags of each variable, Ylag] with themselves and Y,
+    ## for each month of the quarter, over expanding windows 0:n. Rows with a missing lag are masked out of the cumulative sums
+    ## once and kept aside, to be added back for the lag combinations that don't reach the missing lag. Any combination's
+    ## expanding window coefficients are then a small sub-matrix solve, and a rolling window's the difference of two cumulative
+    ## sums. Doesn't depend on skip or the window, so one cache serves every run.
+    def __init__(self, X, Y, Ylag, nlag = None):
+        self.nlag = X.shape[1]-2 if nlag is None else nlag # combinations use 1..maxlag-1 lags
+        self.nvars = X.shape[3]
+        self.ny = len(Y)
+        self.Y = Y.reshape(-1)
+        rows = min(len(X), len(Y)+1) # estimation rows and last nowcast row
+        nlag, nvars, K = self.nlag, self.nvars, 2+self.nvars*self.nlag
+        self.Xpred = np.zeros(shape=(3,rows,K))
+        self.Depth = np.zeros(shape=(3,rows,nvars), dtype=int)
+        self.Gram = np.zeros(shape=(3,self.ny+1,K,K))
+        self.ZY = np.zeros(shape=(3,self.ny+1,K))
+        self.Nrows = np.zeros(shape=(3,self.ny+1))
+        self.Partial = []
+        self.Windows = {} # window: rolling window sums (see Rolling)
+        for pp in range(0,3): # Months
+            Lags = X[0:rows,0:nlag,pp,0:].transpose(0,2,1).reshape(rows,-1) # variable by variable, lags within variable
+            self.Xpred[pp] = np.concatenate((np.ones(shape=(rows,1)), Lags, Ylag[0:rows].reshape(-1,1)), axis=1)
+            Valid = ~np.isnan(X[0:rows,0:nlag,pp,0:])
+            self.Depth[pp] = np.where(Valid.all(axis=1), nlag, Valid.argmin(axis=1)) # leading non-missing lags of each variable
+            Z = np.where(np.isnan(self.Xpred[pp]), 0, self.Xpred[pp])[0:self.ny]
+            Complete = (self.Depth[pp,0:self.ny] == nlag).all(axis=1)
+            self.Gram[pp,1:] = np.cumsum(Complete[:,None,None]*Z[:,:,None]*Z[:,None,:], axis=0)
+            self.ZY[pp,1:] = np.cumsum(Complete[:,None]*Z*Y[0:self.ny].reshape(-1,1), axis=0)
+            self.Nrows[pp,1:] = np.cumsum(Complete)
+            Rows = np.where(~Complete)[0]
+            self.Partial.append((Rows, Z[Rows], Y[Rows].reshape(-1), self.Depth[pp,Rows]))
+
+    def Bytes(self):
+        return sum(Array.nbytes for Array in (self.Xpred, self.Depth, self.Gram, self.ZY, self.Nrows)) + sum(Array.nbytes for Part in self.Partial for Array in Part) \
+            + sum(Array.nbytes for Sums in self.Windows.values() for Array in Sums)
+
+    @staticmethod
+    def Estimate(X, Y, window = None, nlag = None):
+        ## Bytes of the GramCache of X, Y once built (with the sums of one rolling window if window), without building it
+        nlag = X.shape[1]-2 if nlag is None else nlag
+        nvars, ny = X.shape[3], len(Y)
+        rows, K = min(len(X), ny+1), 2+nvars*nlag
+        partial = int((~(~np.isnan(X[0:ny,0:nlag])).all(axis=(1,3))).sum()) # rows missing a lag, over the three months
+        Sums = 3*(ny+1)*(K*K+K+1)*8
+        return 3*rows*(K+nvars)*8 + Sums*(1 if window is None else 2) + partial*(K+nvars+2)*8
+
+    def Rolling(self, window = None):
+        ## cross products over the rolling windows n-window:n (the cumulative sums if window is None), computed once per window
+        if window is None:
+            return self.Gram, self.ZY, self.Nrows
+        if window not in self.Windows:
+            Lo = WindowStart(np.arange(0, self.ny+1), window)
+            self.Windows[window] = (self.Gram - self.Gram[:,Lo], self.ZY - self.ZY[:,Lo], self.Nrows - self.Nrows[:,Lo])
+        return self.Windows[window]
+
+    def Columns(self, combo, AR):
+        ## columns of Z used by a lag combination, in the order [variable 1 lags, variable 2 lags, ..., Ylag]
+        cols = [0] + [1+xx*self.nlag+ll for xx in range(0,self.nvars) for ll in range(0,combo[xx])]
+        return cols + [1+self.nvars*self.nlag] if AR else cols
+
+    def PartialSums(self, combo, pp, cols):
+        ## cumulative cross products of the rows missing a lag this combination doesn't use (to add back), None if there are none
+        Rows, Z, Yp, Depth = self.Partial[pp]
+        Use = (Depth >= np.asarray(combo)).all(axis=1)
+        if not Use.any():
+            return None
+        Zp = Z[np.ix_(Use,cols)]
+        return (Rows[Use], np.concatenate((np.zeros(shape=(1,len(cols),len(cols))), np.cumsum(Zp[:,:,None]*Zp[:,None,:], axis=0))),
+                np.concatenate((np.zeros(shape=(1,len(cols))), np.cumsum(Zp*Yp[Use,None], axis=0))), np.arange(0, Use.sum()+1))
+
+    def Fits(self, combo, pp, skip, stop, AR, Windows = None, Partial = None, window = None):
+        ## out of sample prediction for rows skip..stop of the model with lags combo (fitted on rows 0:jj for row jj)
+        ## or for the rows in Windows (sorted) if given; Partial = its PartialSums if already computed
+        ## window = fitted on the rolling windows jj-window:jj (the sums up to jj less the sums up to jj-window)
+        cols = self.Columns(combo, AR)
+        Windows = np.arange(skip, stop+1) if Windows is None else np.asarray(Windows)
+        Gram, ZY, Nrows = self.Rolling(window)
+        G = Gram[pp][np.ix_(Windows,cols,cols)]
+        R = ZY[pp][np.ix_(Windows,cols)]
+        N = Nrows[pp,Windows].copy()
+        # add back rows missing a lag this combination doesn't use
+        Partial = self.PartialSums(combo, pp, cols) if Partial is None else Partial
+        if Partial:
+            Before = np.searchsorted(Partial[0], Windows) # number of these rows in each window
+            G += Partial[1][Before]
+            R += Partial[2][Before]
+            N += Partial[3][Before]
+            if window is not None:
+                Before = np.searchsorted(Partial[0], WindowStart(Windows, window)) # those before the window
+                G -= Partial[1][Before]
+                R -= Partial[2][Before]
+                N -= Partial[3][Before]
+        Coefs = np.zeros(shape=(len(Windows),len(cols)))
+        Solve = N >= len(cols)
+        try:
+            Coefs[Solve] = np.linalg.solve(G[Solve], R[Solve][:,:,None])[:,:,0]
+        except np.linalg.LinAlgError:
+            Solve[:] = False
+        for kk in np.where(~Solve)[0]:
+            # too few rows or collinear, solve exactly
+            jj, lo = Windows[kk], WindowStart(Windows[kk], window)
+            Z, Valid = self.Xpred[pp,lo:jj][:,cols], (self.Depth[pp,lo:jj] >= np.asarray(combo)).all(axis=1)
+            Coefs[kk] = FitOLS(Z[Valid,1:], self.Y[lo:jj][Valid])
+        Fit = np.einsum('ij,ij->i', self.Xpred[pp][np.ix_(Windows,cols)], Coefs)
+        Fit[(self.Depth[pp,Windows] == 0).any(axis=1)] = np.nan # If any variables in the combo model are nan then do not nowcast with this model
+        return Fit
+
+
+    def BoundedFits(self, combo, pp, skip, stop, AR, bound, Order = None, blocks = 4, window = None):
+        ## Fits abandoned as soon as the squared error over the in-sample rows (skip..len(Y)-1) exceeds bound. The in-sample
+        ## windows are fitted in up to blocks blocks in Order (e.g. largest errors of the best model first, so a losing model
+        ## is caught early), the nowcast rows with the last. Returns the fits (NaN where not fitted), the squared error so far
+        ## and the windows fitted.
+        Fit = np.full(stop-skip+1, np.nan)
+        Insample = np.arange(skip, min(stop+1, self.ny)) if Order is None else np.asarray(Order)
+        Partial = self.PartialSums(combo, pp, self.Columns(combo, AR))
+        Ends = np.unique(np.linspace(0, len(Insample), blocks+1).astype(int))
+        SSE = 0.0
+        for start, end in zip(Ends[:-1], Ends[1:]):
+            Windows = np.sort(Insample[start:end])
+            last = end == len(Insample)
+            Rows = np.append(Windows, np.arange(self.ny, stop+1)) if last else Windows
+            Fit[Rows-skip] = self.Fits(combo, pp, skip, stop, AR, Rows, Partial, window)
+            SSE += np.sum(np.square(self.Y[Windows] - Fit[Windows-skip]))
+            if SSE > bound and not last:
+                return Fit, SSE, end
+        return Fit, SSE, stop+1-skip
+
+
+_GramCaches = OrderedDict() # recently used GramCache, keyed by content of X, Y and Ylag
+
+def GetGramCache(X, Y, Ylag, keep = 4):
+    ## GramCache for this data, reused if the same vintage was seen in one of the last keep runs
+    key = ArrayKey(X, Y, Ylag)
+    if key not in _GramCaches:
+        _GramCaches[key] = GramCache(X, Y, Ylag)
+        while len(_GramCaches) > keep:
+            _GramCaches.popitem(last=False)
+    _GramCaches.move_to_end(key)
+    return _GramCaches[key]
+
+
+def ArrayKey(*arrays, **params):
+    ## content hash of numpy arrays and parameters
+    Hash = hashlib.sha1()
+    for Array in arrays:
+        Array = np.ascontiguousarray(Array)
+        Hash.update(str((Array.shape, Array.dtype.str)).encode())
+        Hash.update(Array.tobytes())
+    Hash.update(repr(sorted(params.items())).encode())
+    return Hash.hexdigest()
+
+
+def DrawChart(Fig, Chart):
+    ## draw a chart spec on a matplotlib figure: one subplot per panel, each line (x, y, marker, color)
+    for Panel, num in zip(Chart['panels'], range(0, len(Chart['panels']))):
+        ax = Fig.add_subplot(len(Chart['panels']), 1, num+1)
+        for x, y, marker, color in Panel['lines']:
+            ax.plot(x, y, marker=marker, color=color, linewidth=2)
+        ax.legend(Panel['legend'], loc='upper left')
+        if Panel.get('title'):
+            ax.set_title(Panel['title'])
+    return Fig
+
+
+def ShowChart(Chart):
+    ## plt.show the chart, or hand it to the active ChartRenderer (copies of the data, so the caller can carry on)
+    Render = ChartRenderer.active if ChartRenderer.active is not None else EnvRenderer()
+    if Render is not None:
+        Render.Add({'name': Chart['name'], 'panels': [dict(Panel, lines=[(np.array(x), np.array(y, dtype=float), marker, color) for x, y, marker, color in Panel['lines']])
+                                                                    for Panel in Chart['panels']]})
+        return
+    DrawChart(plt.figure(figsize=(15,15)), Chart)
+    plt.show()
+
+
+class ChartRenderer:
+    ## Headless chart output: while active (with ChartRenderer(outdir) as Render: ...), PlotBest and PlotSeries don't
+    ## open a window but queue their chart here. A background thread draws each chart with the Agg backend to
+    ## outdir/NN_name.png (and .pdf if in formats) and on exit all charts go into one multi-page report (if given).
+    ## outdir = None only collects the chart specs in self.charts (e.g. in a worker process, to render in the parent).
+    ## The environment variable MIDAS_RENDER=directory makes every run render there instead of plt.show.
+    active = None
+
+    def __init__(self, outdir, report = 'report.pdf', formats = ('png',)):
+        self.outdir, self.report, self.formats = outdir, report, formats
+        self.charts, self.jobs = [], []
+        self.Pool = ThreadPoolExecutor(max_workers=1) if outdir is not None else None
+        if outdir is not None:
+            os.makedirs(outdir, exist_ok=True)
+
+    def __enter__(self):
+        self.previous, ChartRenderer.active = ChartRenderer.active, self
+        return self
+
+    def __exit__(self, *args):
+        ChartRenderer.active = self.previous
+        self.Close()
+
+    def Add(self, Chart):
+        self.charts.append(Chart)
+        if self.Pool is not None:
+            self.jobs.append(self.Pool.submit(self.Render, Chart, len(self.charts)))
+
+    def Render(self, Chart, num):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        Fig = DrawChart(Figure(figsize=(15,15)), Chart)
+        FigureCanvasAgg(Fig)
+        for form in self.formats:
+            Fig.savefig(os.path.join(self.outdir, '%02d_%s.%s' % (num, ''.join(c if c.isalnum() else '_' for c in Chart['name']), form)))
+
+    def Report(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_pdf import PdfPages
+        with PdfPages(os.path.join(self.outdir, self.report)) as Pdf:
+            for Chart in self.charts:
+                Fig = DrawChart(Figure(figsize=(15,15)), Chart)
+                Fig.suptitle(Chart['name'])
+                Pdf.savefig(Fig)
+
+    def Close(self):
+        ## wait for the charts to be written and write the report
+        if self.Pool is None:
+            return
+        if self.report and self.charts:
+            try:
+                self.jobs.append(self.Pool.submit(self.Report))
+            except RuntimeError:
+                self.Report() # at interpreter exit the pool no longer takes work, write it here
+        self.Pool.shutdown(wait=True)
+        for job in self.jobs:
+            job.result() # raise any drawing error here
+        self.Pool = None
+
+
+_EnvRenderer = {} # process id and ChartRenderer of the MIDAS_RENDER default
+
+
+def EnvRenderer():
+    ## ChartRenderer into the MIDAS_RENDER directory if set, None if not. Made on the first chart of each process (not at
+    ## import, so processes that draw nothing start no thread, and forked workers don't inherit one whose thread is gone)
+    if not os.environ.get('MIDAS_RENDER'):
+        return None
+    if _EnvRenderer.get('pid') != os.getpid():
+        _EnvRenderer.update(pid=os.getpid(), renderer=ChartRenderer(os.environ['MIDAS_RENDER']))
+        atexit.register(_EnvRenderer['renderer'].Close)
+    return _EnvRenderer['renderer']
+
+
+class Profiler:
+    ## Time and counters of each stage of a ForecastCombine run (ForecastCombine(..., profile = Profiler())).
+    ## Each stage is a dict with stage, name, seconds and, where known, regressions (models fitted), rows (observations
+    ## in the fitted windows) and peakbytes (largest array). Stages are kept in self.stages, passed to callback(stage)
+    ## as they finish and written as JSON lines to tracefile if given.
+    def __init__(self, callback = None, tracefile = None):
+        self.stages = []
+        self.callback = callback
+        self.tracefile = tracefile
+
+    def Record(self, stage, name = None, **counters):
+        Event = dict(stage = stage, name = name, time = time.time(), **counters)
+        self.stages.append(Event)
+        if self.callback is not None:
+            self.callback(Event)
+        if self.tracefile is not None:
+            with open(self.tracefile, 'a') as Out:
+                Out.write(json.dumps(Event, default=float) + '\n')
+
+    @contextlib.contextmanager
+    def Stage(self, stage, name = None):
+        ## times the block, the yielded dict takes its counters (a seconds entry of None is replaced by the block's time)
+        start_time = time.perf_counter()
+        Counters = {}
+        yield Counters
+        if Counters.get('seconds') is None:
+            Counters['seconds'] = time.perf_counter() - start_time
+        self.Record(stage, name, **Counters)
+
+    def Table(self):
+        ## stages as a DataFrame, slowest first
+        return pd.DataFrame(self.stages).sort_values('seconds', ascending=False)
+
+
+def StageCounters(start_time, regressions, rows, *arrays):
+    ## counters of a backtest started at start_time (time.perf_counter)
+    return {'seconds': time.perf_counter() - start_time, 'regressions': int(regressions), 'rows': int(rows), 'peakbytes': max(Array.nbytes for Array in arrays)}
+
+
+class ResultCache:
+    ## On-disk store of backtest results (pickled objects) keyed by a content hash of their inputs and settings (ArrayKey).
+    ## Least recently used results are removed once the store takes more than maxbytes.
+    def __init__(self, root, maxbytes = 2**30):
+        self.root = root
+        self.maxbytes = maxbytes
+        os.makedirs(root, exist_ok=True)
+
+    def Get(self, key):
+        file = os.path.join(self.root, key + '.pkl')
+        try:
+            with open(file, 'rb') as In:
+                Result = pickle.load(In)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(file) # most recently used
+        return Result
+
+    def Put(self, key, Result):
+        file = os.path.join(self.root, key + '.pkl')
+        with open(file + '.tmp', 'wb') as Out:
+            pickle.dump(Result, Out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file + '.tmp', file) # readers never see a partial file
+        self.Evict()
+
+    def Evict(self):
+        Files = sorted((os.path.join(self.root, name) for name in os.listdir(self.root) if name.endswith('.pkl')), key=os.path.getmtime)
+        total = sum(os.path.getsize(file) for file in Files)
+        while total > self.maxbytes and len(Files) > 1:
+            total -= os.path.getsize(Files[0])
+            os.remove(Files.pop(0))
+
+
+def Memoized(Memo, key, Compute):
+    ## Compute() unless its result is stored under key in Memo (a ResultCache, None for no caching)
+    Result = Memo.Get(key) if Memo is not None else None
+    if Result is None:
+        Result = Compute()
+        if Memo is not None:
+            Memo.Put(key, Result)
+    return Result
+
+
+class TensorStore:
+    ## Out of sample fits of many models (quarter x model x month, as Fit_val) built up chunk by chunk, kept in float64,
+    ## float32 or float32 in a temporary memory mapped file ('mmap', removed with the array). Stored model by model, so
+    ## chunks are appended in place (into a preallocated array if total, the number of models, is known) and Array()
+    ## returns the quarter x model x month view.
+    def __init__(self, storage, rows, total = None):
+        if storage not in ('float64', 'float32', 'mmap'):
+            raise ValueError('unknown storage ' + str(storage))
+        self.storage, self.rows, self.total, self.size = storage, rows, total, 0
+        self.dtype = np.float64 if storage == 'float64' else np.float32
+        self.Blocks = []
+        self.Data = np.empty((total, rows, 3), dtype=self.dtype) if total is not None and storage != 'mmap' else None
+        self.File = tempfile.TemporaryFile() if storage == 'mmap' else None
+
+    @staticmethod
+    def Bytes(storage, rows):
+        ## bytes held in memory per model
+        return 0 if storage == 'mmap' else rows*3*(8 if storage == 'float64' else 4)
+
+    @property
+    def nbytes(self):
+        return 0 if self.File is not None else (self.Data.nbytes if self.Data is not None else sum(Block.nbytes for Block in self.Blocks))
+
+    def Append(self, Fits, RMSE = None):
+        Block = Fits.transpose(1,0,2).astype(self.dtype)
+        if self.File is not None:
+            self.File.write(np.ascontiguousarray(Block).tobytes())
+        elif self.Data is not None:
+            self.Data[self.size:self.size+len(Block)] = Block
+        else:
+            self.Blocks.append(Block)
+        self.size += len(Block)
+
+    def Array(self):
+        if self.File is not None:
+            self.File.flush()
+            Data = np.memmap(self.File, dtype=self.dtype, mode='r', shape=(self.size, self.rows, 3)) if self.size else np.zeros((0, self.rows, 3), dtype=self.dtype)
+        elif self.Data is not None:
+            Data = self.Data[0:self.size]
+        else:
+            Data = np.concatenate(self.Blocks, axis=0) if self.Blocks else np.zeros((0, self.rows, 3), dtype=self.dtype)
+            self.Blocks = [Data]
+        return Data.transpose(1,0,2)
+
+
+class TopKStore:
+    ## Streaming selection: the fitted paths of only the k models with the lowest RMSE in each month (quarter x k x month,
+    ## best first), updated as chunks of models arrive, with their index in the order the models arrived (Index, k x month,
+    ## -1 while fewer than k). Ranked as RMSE.argmin would: NaN first, ties to the earlier model. Same Append and Array as
+    ## TensorStore, so memory is O(quarters x k) whatever the number of models.
+    def __init__(self, rows, k):
+        self.rows, self.k, self.size = rows, k, 0
+        self.Fits = np.full((rows, k, 3), np.nan)
+        self.RMSE = np.full((k, 3), np.inf)
+        self.Index = np.full((k, 3), -1)
+
+    @property
+    def nbytes(self):
+        return self.Fits.nbytes
+
+    def Append(self, Fits, RMSE):
+        ## Fits quarter x models x month of the next models, RMSE month x models
+        Index = np.concatenate((self.Index, self.size + np.arange(0, Fits.shape[1])[:,None].repeat(3, axis=1)))
+        Scores = np.concatenate((self.RMSE, RMSE.T))
+        Pool = np.concatenate((self.Fits, Fits), axis=1)
+        for pp in range(0,3): # Months
+            Order = np.lexsort((np.where(Index[0:,pp] < 0, np.inf, Index[0:,pp]), np.where(np.isnan(Scores[0:,pp]), -np.inf, Scores[0:,pp])))[0:self.k]
+            self.Fits[0:,0:,pp], self.RMSE[0:,pp], self.Index[0:,pp] = Pool[0:,Order,pp], Scores[Order,pp], Index[Order,pp]
+        self.size += Fits.shape[1]
+
+    def Array(self):
+        return self.Fits
+
+
+def SearchSize(combovars, maxlag, budget = None):
+    ## most lag combinations a search can evaluate: every combination of 1..maxlag-1 lags of combovars variables, or budget
+    total = math.comb(maxlag-2+combovars, combovars)
+    return total if budget is None else min(budget, total)
+
+
+def MaxRSS():
+    ## peak resident memory of the process in bytes (None where the resource module is missing)
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+
+
+def ComboBacktest(X, Y, Ylag, combinations, skip, engine = 'gram', Cache = None, Bound = None, window = None):
+    ## Out of sample fits of the multi-indicator model for each combination of lags (one lag length per variable), with and without Ylag
+    ## X is the (quarter, lag, month, variable) store built in OptimMonthlyMultiDiff
+    ## engine = 'gram' solves each window from the cumulative cross products in Cache (a GramCache), 'sklearn' refits (reference)
+    ## Bound = best out of sample squared error so far in each month (with or without Ylag) to prune against (branch and bound,
+    ## gram engine): a model is abandoned once its running squared error is above it, its RMSE set to inf and the rest of its
+    ## fits NaN, and Bound is lowered as better models complete. The best model in each month is never abandoned.
+    ## Also returns the windows fitted for each month and combination (with and without Ylag)
+    ## window = rolling estimation windows of that many quarters (expanding if None)
+    combovars = X.shape[3]
+    ncombos = len(combinations)
+    Fit_val = np.zeros(shape=(len(X)-skip,ncombos,3))
+    RMSE = np.zeros(shape=(3,ncombos))
+    Fit_valAR = np.zeros(shape=(len(X)-skip,ncombos,3))
+    RMSEAR = np.zeros(shape=(3,ncombos))
+    Work = np.zeros(shape=(3,ncombos), dtype=int)
+    if engine == 'gram':
+        Cache = GetGramCache(X, Y, Ylag) if Cache is None else Cache
+        stop = min(len(X)-1, len(Y))
+    for pp in range(0,3): # Months
+        # pruning needs a fit for every in-sample row (a NaN RMSE would win the argmin)
+        prune = Bound is not None and engine == 'gram' and (Cache.Depth[pp,skip:Cache.ny] > 0).all()
+        Order = None # in-sample windows by squared error of the best complete model, largest first
+        for ii in range(0,ncombos): # Up to maxlag
+            if engine == 'gram' and prune:
+                for Out, Scores, AR in ((Fit_val, RMSE, False), (Fit_valAR, RMSEAR, True)):
+                    Out[0:stop+1-skip,ii,pp], SSE, done = Cache.BoundedFits(combinations[ii], pp, skip, stop, AR, Bound[pp]*(1+1e-9), Order, window = window)
+                    Work[pp,ii] += done
+                    if done < stop+1-skip:
+                        Scores[pp,ii] = np.inf # abandoned
+                        continue
+                    Errors = np.square(Y[skip:,0]-Out[0:len(Y)-skip,ii,pp])
+                    Scores[pp,ii] = np.sqrt(np.average(Errors))
+                    if Errors.sum() <= Bound[pp] or Order is None:
+                        Bound[pp] = min(Bound[pp], Errors.sum())
+                        Order = skip + np.argsort(-Errors, kind='stable')
+                continue
+            if engine == 'gram':
+                Fit_val[0:stop+1-skip,ii,pp] = Cache.Fits(combinations[ii], pp, skip, stop, AR=False, window=window)
+                Fit_valAR[0:stop+1-skip,ii,pp] = Cache.Fits(combinations[ii], pp, skip, stop, AR=True, window=window)
+                Work[pp,ii] = 2*(stop+1-skip)
+            else:
+                for jj in range(skip, len(X)): 
+                    if jj<=len(Y):
+                        # Exclude nan values if early series data not available
+                        lo = WindowStart(jj, window)
+                        RegDatX = X[lo:jj,0:combinations[ii][0],pp,0].reshape(-1,combinations[ii][0])
+                        for xx in range(1,combovars):
+                            RegDatX = np.concatenate((RegDatX, X[lo:jj,0:combinations[ii][xx],pp,xx]), axis=1)
+                        RegDatY = Y[lo:jj,0].reshape(-1,1)
+                        Model = LinearRegression().fit(RegDatX[~np.isnan(RegDatX).any(axis=1),0:], RegDatY[~np.isnan(RegDatX).any(axis=1),0])
+                        if np.isnan(X[jj:jj+1,0,pp,0:]).any(): # If any variables in the combo model are nan then do not nowcast with this model
+                            Fit_val[jj-skip:jj+1-skip,ii,pp] = np.nan
+                        else:
+                            predX = X[jj:jj+1,0:combinations[ii][0],pp,0].reshape(-1,combinations[ii][0])
+                            for xx in range(1,combovars):
+                                predX = np.concatenate((predX, X[jj:jj+1,0:combinations[ii][xx],pp,xx].reshape(-1,combinations[ii][xx])), axis=1)
+                            Fit_val[jj-skip:jj+1-skip,ii,pp] = Model.predict(predX).T
+                        
+                        RegDatXAR = np.concatenate((RegDatX, Ylag[lo:jj,0].reshape(-1,1)), axis=1)
+                        ModelAR = LinearRegression().fit(RegDatXAR[~np.isnan(RegDatX).any(axis=1),0:], RegDatY[~np.isnan(RegDatXAR).any(axis=1),0])
+                        if np.isnan(X[jj:jj+1,0,pp,0:]).any():
+                            Fit_valAR[jj-skip:jj+1-skip,ii,pp] = np.nan
+                        else:
+                            Xpred = np.concatenate((predX, Ylag[jj:jj+1,0].reshape(-1,1)), axis=1)
+                            Fit_valAR[jj-skip:jj+1-skip,ii,pp] = ModelAR.predict(Xpred).T
+                        Work[pp,ii] += 2
+                    
+            RMSE[pp,ii] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_val[0:len(Y)-skip,ii,pp]))) # don't include no data but
+            RMSEAR[pp,ii] = np.sqrt(np.average(np.square(Y[skip:,0]-Fit_valAR[0:len(Y)-skip,ii,pp]))) # don't include no data but
+    return Fit_val, Fit_valAR, RMSE, RMSEAR, Work
+
+
+def ModelBacktest(X, Y, Ylag, combo, pp, AR, start, stop, window = None):
+    ## Out of sample prediction for rows start..stop of one model: combo[xx] lags of each variable of X (quarter, lag, month,
+    ## variable) in month pp, plus Ylag if AR. Fitted on the rows 0:jj with all of these lags for row jj, NaN if row jj is missing one
+    ## window = fitted on the rows jj-window:jj
+    Lags = np.concatenate([X[0:,0:combo[xx],pp,xx] for xx in range(0,X.shape[3])], axis=1)
+    Z = np.concatenate((Lags, Ylag[0:len(X)].reshape(-1,1)), axis=1) if AR else Lags
+    Valid = ~np.isnan(Lags).any(axis=1)
+    Fit = np.full(stop-start+1, np.nan)
+    for jj in range(start, stop+1):
+        if Valid[jj]:
+            lo = WindowStart(jj, window)
+            Coefs = FitOLS(Z[lo:jj][Valid[lo:jj]], Y[lo:jj,0][Valid[lo:jj]])
+            Fit[jj-start] = Coefs[0] + Z[jj] @ Coefs[1:]
+    return Fit
+
+
+def _ComboTask(combinations, Bound = None):
+    if _Worker['engine'] == 'gram' and 'gram' not in _Worker:
+        _Worker['gram'] = GramCache(_Worker['X'], _Worker['Y'], _Worker['Ylag']) # once per worker
+    return ComboBacktest(_Worker['X'], _Worker['Y'], _Worker['Ylag'], combinations, _Worker['skip'], _Worker['engine'], _Worker.get('gram'), Bound, _Worker['window'])
+
+
+def EvaluateCombos(X, Y, Ylag, combinations, skip, Pool = None, n_jobs = 1, engine = 'gram', Bound = None, window = None, Cache = None):
+    ## ComboBacktest of combinations, in chunks over Pool (a SharedPool holding X, Y, Ylag, skip, engine and window) if given
+    ## Bound = squared errors to prune against (see ComboBacktest), each chunk starts from the bound when it is sent
+    ## Cache = GramCache of X, Y, Ylag for the serial case (looked up by content if None)
+    if Pool is None:
+        return ComboBacktest(X, Y, Ylag, combinations, skip, engine, Cache, Bound, window)
+    chunk = int(np.ceil(len(combinations)/(4*NumJobs(n_jobs)))) # a few chunks per worker to balance the load
+    Parts = [combinations[start:start+chunk] for start in range(0, len(combinations), chunk)]
+    Chunks = list(Pool.map(_ComboTask, Parts, [Bound]*len(Parts)))
+    return tuple(np.concatenate([c[kk] for c in Chunks], axis=1) for kk in range(0,5))
+
+
+def LagSearch(Evaluate, combovars, maxlag, search, budget = None, beamwidth = 3):
+    ## Heuristic search over the lag length (1..maxlag-1) of each variable, run for each month of the quarter. Like the
+    ## exhaustive search (combinations_with_replacement) it only visits non-decreasing lag combinations, so the exhaustive
+    ## search covers every model a heuristic can find
+    ## Evaluate(list of combinations) returns their RMSE (3 months x combinations). Combinations are only evaluated once and
+    ## the search stops when it can't improve or after budget combinations.
+    ## 'greedy': from one lag of each variable, add the single lag that improves RMSE most
+    ## 'beam': as greedy but keep the beamwidth best models at each step
+    ## 'coordinate': set the lag of each variable in turn to its best value given the others, until no change
+    Score = {}
+    def Run(candidates):
+        candidates = [combo for combo in dict.fromkeys(candidates) if combo not in Score]
+        if budget is not None:
+            candidates = candidates[0:max(0, budget-len(Score))]
+        if candidates:
+            Score.update(zip(candidates, Evaluate(candidates).T))
+        return [combo for combo in candidates if combo in Score]
+    def Ordered(combos):
+        return [combo for combo in combos if all(combo[xx] <= combo[xx+1] for xx in range(0,combovars-1))]
+    def Grow(combo):
+        return Ordered([combo[:xx] + (combo[xx]+1,) + combo[xx+1:] for xx in range(0,combovars) if combo[xx] < maxlag-1])
     
+    start = (1,)*combovars
+    Run([start])
+    for pp in range(0,3): # Months
+        Loss = lambda combo: np.nan_to_num(Score[combo][pp], nan=np.inf)
+        if search == 'greedy':
+            current = start
+            while True:
+                Run(Grow(current))
+                nextstep = [combo for combo in Grow(current) if combo in Score]
+                if not nextstep or Loss(min(nextstep, key=Loss)) >= Loss(current):
+                    break
+                current = min(nextstep, key=Loss)
+        elif search == 'beam':
+            beam = [start]
+            while True:
+                children = [combo for parent in beam for combo in Grow(parent)]
+                Run(children)
+                newbeam = sorted(dict.fromkeys(beam + [combo for combo in children if combo in Score]), key=Loss)[0:beamwidth]
+                if set(newbeam) == set(beam):
+                    break
+                beam = newbeam
+        elif search == 'coordinate':
+            current, changed = start, True
+            while changed:
+                changed = False
+                for xx in range(0,combovars):
+                    line = Ordered([current[:xx] + (ll,) + current[xx+1:] for ll in range(1,maxlag)])
+                    Run(line)
+                    best = min([combo for combo in line if combo in Score], key=Loss)
+                    if Loss(best) < Loss(current):
+                        current, changed = best, True
+        else:
+            raise ValueError("search must be 'exhaustive', 'greedy', 'beam' or 'coordinate'")
+    return list(Score)
+
+
+def NumJobs(n_jobs):
+    ## number of worker processes, -1 for all cores
+    return os.cpu_count() if n_jobs == -1 else max(1, n_jobs)
+
+
+_Worker = {} # shared arrays and settings seen by each pool worker
+
+def _InitWorker(Specs, Settings):
+    for key, (name, shape, dtype) in Specs.items():
+        Block = shared_memory.SharedMemory(name=name)
+        _Worker[key+'_block'] = Block # keep the block open for the life of the worker
+        _Worker[key] = np.ndarray(shape, dtype=dtype, buffer=Block.buf)
+        _Worker[key].flags.writeable = False
+    _Worker.update(Settings)
+
+
+@contextlib.contextmanager
+def SharedPool(Arrays, Settings, n_jobs):
+    ## process pool whose workers see the dict of numpy Arrays through shared memory (read only, no per-task pickling)
+    ## and Settings as _Worker globals. Shared memory is released on exit.
+    Blocks, Specs = [], {}
+    try:
+        for key, Array in Arrays.items():
+            Block = shared_memory.SharedMemory(create=True, size=max(Array.nbytes,1))
+            Blocks.append(Block)
+            np.ndarray(Array.shape, dtype=Array.dtype, buffer=Block.buf)[...] = Array
+            Specs[key] = (Block.name, Array.shape, Array.dtype.str)
+        with ProcessPoolExecutor(max_workers=NumJobs(n_jobs), initializer=_InitWorker, initargs=(Specs, Settings)) as Pool:
+            yield Pool
+    finally:
+        for Block in Blocks:
+            Block.close()
+            Block.unlink()
+
+
+def _MonthlyTask(jj):
+    Panel = _Worker['panel']
+    Temp = OptimMonthly(GDP = _Worker['GDP'], monthly = Panel[0:,jj])
+    Temp.Forecastperf(skip = _Worker['skip'], maxlag = _Worker['maxlag'], X = LagTensor(Panel, _Worker['maxlag'])[0:,0:,0:,jj], window = _Worker['window'], select = _Worker['select'])
+    Temp.GDP, Temp.monthly = None, None # don't send inputs back
+    return Temp
+
+
+def MonthlyBacktests(GDP, Panel, skip, maxlag, n_jobs = 1, X = None, window = None, select = 'oos'):
+    ## OptimMonthly backtest of each column of the monthly Panel (from MonthlyPanel), returned in column order
+    ## X = LagTensor(Panel, maxlag) if already built, window = rolling estimation windows and select = how the lags are chosen
+    ## (see OptimMonthly.Forecastperf)
+    ## n_jobs > 1 fans the series out over a process pool with the panel in shared memory
+    nseries = Panel.shape[1]
+    if NumJobs(n_jobs) == 1 or nseries < 2:
+        X = LagTensor(Panel, maxlag) if X is None else X
+        Backtests = []
+        for jj in range(0, nseries):
+            Temp = OptimMonthly(GDP = GDP, monthly = Panel[0:,jj])
+            Temp.Forecastperf(skip = skip, maxlag = maxlag, X = X[0:,0:,0:,jj], window = window, select = select)
+            Backtests.append(Temp)
+        return Backtests
+    with SharedPool({'panel': Panel}, {'GDP': GDP, 'skip': skip, 'maxlag': maxlag, 'window': window, 'select': select}, min(NumJobs(n_jobs), nseries)) as Pool:
+        return list(Pool.map(_MonthlyTask, range(0, nseries)))
+
+
+def MonthlyPanel(monthlyseries, mmap = None):
+    ## Stack monthly series into one (month, series) array, padded with NaN to whole quarters
+    ## mmap = file name to hold the panel in a memory mapped .npy file (for large panels)
+    nmonths = 3*int(np.ceil(max(len(series) for series in monthlyseries)/3))
+    if mmap is None:
+        Panel = np.full((nmonths, len(monthlyseries)), np.nan)
+    else:
+        Panel = np.lib.format.open_memmap(mmap, mode='w+', dtype=float, shape=(nmonths, len(monthlyseries)))
+        Panel[...] = np.nan
+    for series, jj in zip(monthlyseries, range(0, len(monthlyseries))):
+        Panel[0:len(series),jj] = np.asarray(series, dtype=float).reshape(-1)
+    return Panel
+
+
+def LagTensor(monthly, maxlag):
+    ## Store of regressors X[quarter, lag, month of quarter, variable] = monthly[3*(startq+quarter)+month-lag, variable],
+    ## startq = ceil(maxlag/3), as in OptimMonthly. Returned as a read-only strided view of the monthly data, so no lag or
+    ## month is copied. monthly is padded with NaN to whole quarters first (no copy if already padded, e.g. from MonthlyPanel).
+    monthly = np.asarray(monthly, dtype=float).reshape(len(monthly),-1)
+    if len(monthly) % 3:
+        monthly = MonthlyPanel([monthly[0:,xx] for xx in range(0, monthly.shape[1])])
+    startq = int(np.ceil(maxlag/3))
+    length = len(monthly)//3
+    # Window[row, variable, kk] = monthly[row+kk, variable]
+    Window = np.lib.stride_tricks.sliding_window_view(monthly, maxlag+1, axis=0)
+    Window = Window[3*startq-maxlag:3*length-maxlag].reshape(length-startq, 3, monthly.shape[1], maxlag+1)
+    return Window[0:,0:,0:,::-1].transpose(0,3,1,2)
+
+
 def DelaySeries(DFmonth, Delay):
-    Delay2 = np.asarray(Delay)
-    # add row if no space to lag series
-    if np.any(~np.isnan(DFmonth.iloc[-1,Delay2==1])):
-        last_date = DFmonth.iloc[[-1]].index+1
-        DFmonth = DFmonth.append(pd.DataFrame(index=[last_date]))
-    DFmonthhold = DFmonth.copy()
-    DFmonth = DFmonth[1*3:] # Get rid of first three months to match Quarterly
-    # Add extra row if shift goes into non-existent month
-    
-    
-    for ii in range(len(Delay)):
+    ## Delay[ii] = months the ii-th series is released late (1 = value for December first seen in January), see AlignPanel
+    return AlignPanel(DFmonth, shifts = Delay)
+
+
+def PublicationLags(calendar):
+    ## Publication lag in days of each series (median of release date - last day of the reference period) from a release
+    ## calendar, a csv file or frame with columns release_date, series_id, ref_period (e.g. 2024-01 or 2024Q1), lines
+    ## starting with # ignored, or a table of series_id and lag_days. Returns a series of days by series_id
+    Calendar = pd.read_csv(calendar, comment='#', skipinitialspace=True) if isinstance(calendar, (str, os.PathLike)) else calendar
+    if 'lag_days' in Calendar.columns:
+        return Calendar.set_index('series_id')['lag_days'].astype(int)
+    End = [pd.Period(ref.replace('-Q', 'Q'), freq='Q' if 'Q' in ref else 'M').end_time.normalize() for ref in Calendar['ref_period'].astype(str)]
+    Lag = (pd.to_datetime(Calendar['release_date']) - pd.DatetimeIndex(End)).dt.days
+    return Lag.groupby(Calendar['series_id'].values).median().astype(int)
 
-        if Delay[ii]==0:
-            DFmonth.iloc[:,ii]= DFmonthhold.iloc[1*3:,ii]
+
+def _ExtendIndex(Index, start, length):
+    ## labels of rows start, ..., start+length-1 of Index, rows past its end continuing a numeric index by its last step
+    ## (as DelaySeries always did for a RangeIndex) and labelled by row position otherwise
+    Labels = list(Index[start:start+length])
+    extra = length - len(Labels)
+    if extra > 0:
+        if pd.api.types.is_numeric_dtype(Index) and len(Index):
+            step = Index[-1] - Index[-2] if len(Index) > 1 else 1
+            Labels += [Index[-1] + step*kk for kk in range(1, extra+1)]
         else:
-            DFmonth.iloc[:,ii] = DFmonthhold.iloc[1*3-Delay[ii]:-Delay[ii], ii].values  
-        
-    return DFmonth
-    
\ No newline at end of file
+            Labels += list(range(len(Index), len(Index) + extra))
+    return pd.RangeIndex(start=Labels[0], stop=Labels[0] + Index.step*length, step=Index.step) if isinstance(Index, pd.RangeIndex) and length else pd.Index(Labels)
+
+
+def AlignPanel(DFmonth, lags = None, asof = None, shifts = None, skip = 3):
+    ## Align the monthly series on their ragged edge from their publication lags (release calendar): row m of the result
+    ## holds what is published in month m, i.e. each series is shifted forward by the months from a value's month to the
+    ## month of its release date (lag <= 0, a flash release within the month, no shift; a lag that ends in the next month,
+    ## one month; and so on), the fewest over the months of the panel where month lengths make it vary (a 31 day lag).
+    ## lags = days for each column (list, or dict/series by column name, e.g. from PublicationLags), or shifts = months
+    ## asof = date: values released after it (last day of the month + lag) are masked as not yet known, and rows after
+    ## its month dropped, so the panel is the data as it could be seen on any day of the quarter
+    ## The first skip months are dropped (to match the quarterly target, as before) and rows added where the shift
+    ## runs past the end. Vectorized, one scatter for the whole panel.
+    ## On an index of other labels (e.g. the RangeIndex left by pd.merge) the rows are taken as consecutive months and
+    ## shifted by position; the result keeps the caller's labels (a DatetimeIndex comes back as one, at the same day of month)
+    if not isinstance(DFmonth.index, (pd.PeriodIndex, pd.DatetimeIndex)):
+        if asof is not None:
+            raise ValueError('AlignPanel: asof needs a PeriodIndex or DatetimeIndex of months')
+        Aligned = AlignPanel(DFmonth.set_axis(pd.period_range('2000-01', periods=len(DFmonth), freq='M'), axis=0), lags, shifts = shifts, skip = skip)
+        return Aligned.set_axis(_ExtendIndex(DFmonth.index, skip, len(Aligned)), axis=0)
+    if isinstance(DFmonth.index, pd.DatetimeIndex):
+        Start = bool((DFmonth.index.day == 1).all())
+        Aligned = AlignPanel(DFmonth.set_axis(DFmonth.index.to_period('M'), axis=0), lags, asof, shifts, skip)
+        Dates = Aligned.index.to_timestamp(how='start') if Start else Aligned.index.to_timestamp(how='end').normalize()
+        return Aligned.set_axis(Dates, axis=0)
+    Index = DFmonth.index if isinstance(DFmonth.index, pd.PeriodIndex) else pd.PeriodIndex(DFmonth.index, freq='M')
+    if not (Index.is_monotonic_increasing and Index[-1].ordinal - Index[0].ordinal == len(Index) - 1):
+        # every month in order, e.g. after concatenating series that start at different dates
+        Index = pd.period_range(Index.min(), Index.max(), freq='M')
+        DFmonth = DFmonth.set_axis(DFmonth.index if isinstance(DFmonth.index, pd.PeriodIndex) else pd.PeriodIndex(DFmonth.index, freq='M'), axis=0).reindex(Index)
+    Values = DFmonth.values.astype(float)
+    Known = ~np.isnan(Values)
+    if lags is not None:
+        Lags = np.array(lags if isinstance(lags, (list, tuple, np.ndarray)) else [lags[column] for column in DFmonth.columns], dtype=float)
+        # release date of every value: last day of its month + the lag of its series (days since 1970-01-01)
+        End = Index.to_timestamp(how='end').normalize().values.astype('datetime64[D]').astype(np.int64)
+        Release = End[:,None] + np.ceil(Lags[None,:]).astype(np.int64)
+        # months from each value's month to the month it is released in (same calendar as the asof mask), the fewest over
+        # the panel for each series, so no value lands in a row after the month it is released in
+        Months = Release.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) - Index.asi8[:,None]
+        Shift = np.maximum(Months.min(axis=0), 0) if len(Months) else np.zeros(len(Lags), dtype=int)
+        if asof is not None:
+            Known &= Release <= np.datetime64(pd.Timestamp(asof).date(), 'D').astype(np.int64)
+    else:
+        Shift = np.asarray(shifts, dtype=int)
+    Last = np.where(Known.any(axis=0), len(Values) - 1 - np.argmax(Known[::-1], axis=0), -1) # last known row of each series
+    nrows = max(len(Values), int((Last + Shift).max()) + 1)
+    if asof is not None:
+        nrows = min(nrows, pd.Period(pd.Timestamp(asof), freq='M').ordinal - Index[0].ordinal + 1)
+    Aligned = np.full((max(nrows, 0) + Shift.max(), Values.shape[1]), np.nan)
+    Rows, Columns = np.nonzero(Known)
+    Aligned[Rows + Shift[Columns], Columns] = Values[Rows, Columns]
+    Index = pd.period_range(Index[0], periods=len(Aligned), freq=Index.freq)
+    return pd.DataFrame(Aligned, index=Index, columns=DFmonth.columns)[skip:max(nrows, skip)]
+
+
+# from MIDAS import * gives the models and tools below, not the modules or the lazy stand-ins (the scripts import those themselves)
+__all__ = ['OptimAR', 'OptimARoos', 'OptimMonthly', 'OptimMonthlyMultiDiff', 'ForecastCombine',
+           'WeightedMeanNaN', 'WeightedCube', 'SchemeWeights', 'CombineForecasts',
+           'FitOLS', 'Criteria', 'SelectionScores', 'RecursiveLS', 'OrderRecursiveOLS', 'GramCache', 'GetGramCache',
+           'ComboBacktest', 'EvaluateCombos', 'LagSearch', 'SearchSize', 'SharedPool', 'MonthlyBacktests',
+           'TensorStore', 'TopKStore', 'ResultCache', 'Profiler', 'ShowChart', 'ChartRenderer',
+           'MonthlyPanel', 'LagTensor', 'DelaySeries', 'PublicationLags', 'AlignPanel']
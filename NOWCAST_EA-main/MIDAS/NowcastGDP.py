@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Expenditure side GDP nowcast from the component scripts (ImportData_*.py).
+
+The Haver codes of every component, and the GDP levels they are weighted with, are prefetched once (HaverCache.Prefetch),
+then the component scripts run at the same time on a process pool, headless (no blocking plt.show), each served its data
+from memory. Their charts are collected and drawn in the background into one report (charts/NowcastGDP.pdf). The
+component nowcasts are weighted by their share of real GDP in the previous quarter and added up to a GDP growth nowcast.
+"""
+import os
+import io
+import sys
+import time
+import runpy
+import warnings
+import contextlib
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from concurrent.futures import ProcessPoolExecutor
+import HaverCache as hv
+import MIDAS # loaded once here so forked workers start with it
+
+dirname = os.path.dirname(os.path.abspath(__file__))
+
+HVdb = 'USECON' # Haver database of the GDP components
+GDPcode = 'gdph' # real GDP
+begindate = '1992-01-01' # Start of data download
+
+# Components: name, script, Haver code of the real level, how the nowcast enters GDP growth
+# 'growth' q/q % growth weighted by its share of GDP, 'imports' the same subtracted, 'change' change in inventories
+# (level, so its change over the previous quarter relative to GDP), None reported but not added (exports less imports already counted)
+Components = [('Consumption', 'ImportData_Consumption.py', 'ch', 'growth'),
+              ('Non-res investment', 'ImportData_InvestmentNonResidential.py', 'fnh', 'growth'),
+              ('Res investment', 'ImportData_InvestmentResidential.py', 'frh', 'growth'),
+              ('Government', 'ImportData_Government.py', 'gh', 'growth'),
+              ('Inventories', 'ImportData_Inventories.py', 'vh', 'change'),
+              ('Exports', 'ImportData_Exports.py', 'xh', 'growth'),
+              ('Imports', 'ImportData_Imports.py', 'mh', 'imports'),
+              ('Trade contribution', 'ImportData_TradeContribution.py', 'ptxneth', None)]
+
+
+def _InitWorker(Memory):
+    import matplotlib
+    matplotlib.use('Agg') # any plt.show left in the scripts doesn't block
+    if dirname not in sys.path:
+        sys.path.insert(0, dirname)
+    hv.Memory.update(Memory)
+
+
+def RunComponent(script):
+    ## run one component script and return its ForecastCombine (TestFcastHav), dates, printed output and charts
+    ## (chart specs collected, not drawn, so they are rendered together in the parent)
+    start_time = time.time()
+    Output = io.StringIO()
+    with contextlib.redirect_stdout(Output), MIDAS.ChartRenderer(None) as Charts:
+        Globals = runpy.run_path(os.path.join(dirname, script), run_name='__component__')
+    return {'model': Globals['TestFcastHav'], 'dates': Globals['date_list'], 'name': Globals['Quarterlyname'],
+            'output': Output.getvalue(), 'charts': Charts.charts, 'seconds': time.time() - start_time}
+
+
+def NowcastComponents(Components = Components, workers = None):
+    ## prefetch the data of all components and run them concurrently, results returned in the order of Components
+    ## workers = number of processes (default one per component, up to the number of cores)
+    hv.Prefetch([os.path.join(dirname, Component[1]) for Component in Components], requests=[Levels(Components)])
+    workers = min(len(Components), os.cpu_count()) if workers is None else workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_InitWorker, initargs=(hv.Memory,)) as Pool:
+        return list(Pool.map(RunComponent, [Component[1] for Component in Components]))
+
+
+def RenderCharts(Results, outdir = os.path.join(dirname, 'charts'), report = 'NowcastGDP.pdf'):
+    ## draw the charts of all components in the background, one png each and one pdf report; returns the renderer,
+    ## Close() it to wait for the files
+    Render = MIDAS.ChartRenderer(outdir, report=report)
+    for Result in Results:
+        for Chart in Result['charts']:
+            Render.Add(Chart)
+    return Render
+
+
+def LatestNowcast(Model):
+    ## nowcast of the current quarter using the most months of data available (last non-missing of Month 1-3)
+    return Model.Nowcast()
+
+
+def Levels(Components = Components):
+    ## (codes, database, frequency, startdate) of the real levels AggregateGDP weights the components with, prefetched
+    ## with the data of the scripts
+    return [Component[2] for Component in Components if Component[3]] + [GDPcode], HVdb, 'Q', begindate
+
+
+def AggregateGDP(Results, Components = Components):
+    ## contribution of each component to q/q GDP growth in the nowcast quarter and their sum, NaN (with a warning naming
+    ## them) if any component that enters GDP has no nowcast
+    Quarter = pd.Period(Results[0]['dates'][-1], freq='Q')
+    codes, database, frequency, startdate = Levels(Components)
+    Previous = hv.data(codes, database, frequency=frequency, startdate=startdate).loc[Quarter-1]
+    Rows = []
+    for Component, Result in zip(Components, Results):
+        Nowcast, month = LatestNowcast(Result['model'])
+        if Component[3] == 'growth':
+            Contribution = Previous[Component[2]]/Previous[GDPcode]*Nowcast
+        elif Component[3] == 'imports':
+            Contribution = -Previous[Component[2]]/Previous[GDPcode]*Nowcast
+        elif Component[3] == 'change':
+            Contribution = 100*(Nowcast - Previous[Component[2]])/Previous[GDPcode]
+        else:
+            Contribution = np.nan
+        Rows.append([Component[0], Nowcast, month, Contribution])
+    Table = pd.DataFrame(Rows, columns=['Component', 'Nowcast', 'Month', 'Contribution']).set_index('Component')
+    Added = [Component[0] for Component in Components if Component[3]]
+    Missing = [name for name in Added if np.isnan(Table.loc[name, 'Contribution'])]
+    if Missing:
+        warnings.warn('no nowcast for %s, the GDP nowcast is left missing' % ', '.join(Missing))
+    GDP = Table.loc[Added, 'Contribution'].sum(min_count=len(Added)) # q/q %
+    return Table, GDP, 100*((1+GDP/100)**4-1), Quarter
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    hv.path('auto') # path for Haver
+    Results = NowcastComponents()
+    Render = RenderCharts(Results)
+    for Component, Result in zip(Components, Results):
+        print('\n' + Component[0] + ' (%.1f seconds)' % Result['seconds'])
+        print(Result['output'])
+    Table, GDP, GDPannual, Quarter = AggregateGDP(Results)
+    print('\n')
+    print('Expenditure side GDP nowcast for ' + str(Quarter))
+    print(tabulate(Table.reset_index().values.tolist(), headers=['Component', 'Nowcast', 'Month', 'Contribution (q/q %)']))
+    print(tabulate([['GDP q/q %', GDP], ['GDP q/q % annualized', GDPannual]]))
+    Render.Close()
+    print('Charts in ' + os.path.join(Render.outdir, Render.report))
+    print("--- %s seconds ---" % (time.time() - start_time))
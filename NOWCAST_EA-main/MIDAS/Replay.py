@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily pseudo real-time replay of the nowcasts.
+
+Steps through every day of a quarter (or any range of dates), takes the data as they were known on that day, from a
+VintageStore or from final data and a release calendar, and records the nowcast path as the data arrive. Estimation is
+reused across days: lags are chosen by ForecastCombine.Optimize only when a new release of the target arrives, days
+without new data keep the previous nowcast, and on the other days only the windows whose data changed are refitted
+(ForecastCombine.Update).
+
+Replay(CalendarSource(Monthly_dat, Target_dat, PublicationLags('calendar.csv'), gdplag = 30), quarter = '2019Q3',
+       Settings = dict(skip = 40, ARt = 5, maxlag = 6, ARinclude = 0, weighttype = 'mse', names = Reg_names))
+"""
+import io
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from MIDAS import ForecastCombine, AlignPanel
+
+
+def Arrays(GDP, Panel):
+    ## GDP and monthlyseries arrays for ForecastCombine: monthly series from the first month of the first quarter to the end
+    ## of the quarter after the last GDP release (the nowcast quarter), NaN where not yet known
+    Months = pd.period_range(GDP.index[0].asfreq('M', how='start'), periods=3*(len(GDP)+1), freq='M')
+    return GDP.values.reshape(-1,1), [Panel[column].reindex(Months).values.reshape(-1,1) for column in Panel.columns], GDP.index[-1]+1
+
+
+class CalendarSource:
+    ## Pseudo real-time data from final data and a release calendar. Monthly = frame of the monthly series (PeriodIndex),
+    ## Quarterly = target series (PeriodIndex), lags = publication lag in days of each monthly series (see AlignPanel),
+    ## gdplag = days after the end of a quarter its target value is released
+    def __init__(self, Monthly, Quarterly, lags, gdplag):
+        self.Monthly, self.lags, self.gdplag = Monthly, lags, gdplag
+        self.Quarterly = Quarterly.squeeze(axis=1) if isinstance(Quarterly, pd.DataFrame) else Quarterly
+        self.Released = self.Quarterly.index.to_timestamp(how='end').normalize() + pd.Timedelta(days=gdplag)
+
+    def __call__(self, asof):
+        GDP = self.Quarterly[self.Released <= pd.Timestamp(asof)]
+        return Arrays(GDP, AlignPanel(self.Monthly, self.lags, asof = asof, skip = 0))
+
+
+class VintageSource:
+    ## Real-time data from a VintageStore: the vintages of the monthly series and the target as of each day, aligned on
+    ## their publication lags (or shifts in months) if given, start = first quarter of the target (e.g. '1992Q2')
+    def __init__(self, Store, monthly, quarterly, start = None, lags = None, shifts = None):
+        self.Store, self.monthly, self.quarterly, self.start = Store, monthly, quarterly, start
+        self.lags, self.shifts = lags, shifts
+
+    def __call__(self, asof):
+        GDP = self.Store.Series(self.quarterly, asof)
+        GDP = GDP.loc[pd.Period(self.start, freq='Q'):] if self.start is not None else GDP
+        Panel = pd.concat([self.Store.Series(name, asof) for name in self.monthly], axis=1)
+        if self.lags is not None or self.shifts is not None:
+            Panel = AlignPanel(Panel, self.lags, shifts = self.shifts, skip = 0)
+        return Arrays(GDP, Panel)
+
+
+def Same(Old, New):
+    return Old.shape == New.shape and np.array_equal(Old, New, equal_nan=True)
+
+
+def Replay(Source, Settings, days = None, quarter = None, reselect = 'release'):
+    ## Nowcast on every day of days (dates) or of quarter (e.g. '2019Q3'), from the data Source(day) returns.
+    ## Settings = the other ForecastCombine arguments (skip, ARt, maxlag, ARinclude, weighttype, names, ..., cachedir)
+    ## reselect = 'release': Optimize when the target is released or revised, Update on other days with new data;
+    ## 'daily': Optimize on every day with new data (the slow reference)
+    ## Returns a frame by day: target quarter, nowcast and the month of the quarter it uses, the combined Month 1-3
+    ## nowcasts, what was done (optimize, update or none) and the seconds it took
+    days = pd.date_range(pd.Period(quarter, freq='Q').start_time, pd.Period(quarter, freq='Q').end_time.normalize()) if days is None else pd.DatetimeIndex(days)
+    Rows, Model, Last = [], None, None
+    for day in days:
+        start_time = time.perf_counter()
+        GDP, monthly, target = Source(day)
+        if Last is not None and Same(Last[0], GDP) and all(Same(old, new) for old, new in zip(Last[1], monthly)):
+            action = 'none'
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if Model is None or reselect == 'daily' or not Same(Last[0], GDP):
+                    Model = ForecastCombine(GDP = GDP, monthlyseries = monthly, **dict(Settings, names = list(Settings['names'])))
+                    Model.Optimize()
+                    action = 'optimize'
+                else:
+                    Model.Update(monthly)
+                    action = 'update'
+            Last = (GDP, monthly)
+        Nowcast, month = Model.Nowcast()
+        Rows.append([day, str(target), Nowcast, month] + Model.OptimalFit[-1].tolist() + [action, time.perf_counter() - start_time])
+    return pd.DataFrame(Rows, columns = ['date', 'quarter', 'nowcast', 'month', 'Month1', 'Month2', 'Month3', 'action', 'seconds']).set_index('date')
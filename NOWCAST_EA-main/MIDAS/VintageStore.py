@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only store of real-time data vintages for pseudo real-time evaluation.
+
+Every observation is one record (series, reference period, release date, value) in flat binary columns, read through
+memory maps. Only new or revised values are appended, so a daily vintage adds a handful of records, and a snapshot of the
+data as it was known on any date is read straight from the one copy on disk.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+Columns = {'series': np.int32, 'period': np.int64, 'release': np.int64, 'value': np.float64}
+
+
+def Day(date):
+    ## release date as days since 1970-01-01
+    return int(np.datetime64(pd.Timestamp(date).date(), 'D').astype(np.int64))
+
+
+def Periods(ordinals, freq):
+    ## PeriodIndex from period ordinals
+    return pd.PeriodIndex(pd.arrays.PeriodArray(np.asarray(ordinals, dtype=np.int64), dtype=pd.PeriodDtype(freq)))
+
+
+def PeriodOffset(freq):
+    ## period frequency (offset) of dates at frequency freq, from the offset itself rather than its alias, which differs
+    ## across pandas versions ('M'/'ME', 'A'/'Y'): months for any monthly dates, quarters and years with the same
+    ## boundaries as the dates mark (quarters anchored on the year end month in October-December, so calendar quarters
+    ## are Q-DEC whatever month pd.infer_freq anchors QS on, and 'QS-NOV' dates give quarters ending in January), others as is
+    Offset = pd.tseries.frequencies.to_offset(freq)
+    if isinstance(Offset, (pd.offsets.MonthBegin, pd.offsets.MonthEnd, pd.offsets.BusinessMonthBegin, pd.offsets.BusinessMonthEnd)):
+        return pd.offsets.MonthEnd()
+    if isinstance(Offset, (pd.offsets.QuarterBegin, pd.offsets.BQuarterBegin, pd.offsets.QuarterEnd, pd.offsets.BQuarterEnd)):
+        end = Offset.startingMonth + (2 if isinstance(Offset, (pd.offsets.QuarterBegin, pd.offsets.BQuarterBegin)) else 0)
+        return pd.offsets.QuarterEnd(startingMonth=(end - 10) % 3 + 10)
+    if isinstance(Offset, (pd.offsets.YearBegin, pd.offsets.BYearBegin)):
+        return pd.offsets.YearEnd(month=(Offset.month - 2) % 12 + 1)
+    if isinstance(Offset, pd.offsets.BYearEnd):
+        return pd.offsets.YearEnd(month=Offset.month)
+    return Offset
+
+
+class VintageStore:
+    ## Vintages of series under root. Append adds a release of a series, Series and Snapshot read the data as of a date.
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.file = os.path.join(root, 'series.json')
+        Meta = {'names': [], 'freqs': []}
+        if os.path.exists(self.file):
+            with open(self.file) as In:
+                Meta = json.load(In)
+        self.names, self.freqs = Meta['names'], Meta['freqs']
+        self.Open()
+
+    def Open(self):
+        ## map the columns. Records past the shortest column are from an interrupted append: every column is cut back to the
+        ## shortest, so the next append lines up again
+        Sizes = [os.path.getsize(os.path.join(self.root, key)) // np.dtype(dtype).itemsize if os.path.exists(os.path.join(self.root, key)) else 0
+                 for key, dtype in Columns.items()]
+        self.size = min(Sizes)
+        for key, dtype in Columns.items():
+            if os.path.exists(os.path.join(self.root, key)) and os.path.getsize(os.path.join(self.root, key)) != self.size*np.dtype(dtype).itemsize:
+                os.truncate(os.path.join(self.root, key), self.size*np.dtype(dtype).itemsize)
+        for key, dtype in Columns.items():
+            Column = np.memmap(os.path.join(self.root, key), dtype=dtype, mode='r', shape=(self.size,)) if self.size else np.zeros(0, dtype=dtype)
+            setattr(self, key, Column)
+        self.order, self.bounds = None, None
+
+    def Index(self):
+        ## records sorted by series, period and release (kept until the next Append) and the slice of each series
+        if self.order is None:
+            self.order = np.lexsort((self.release, self.period, self.series))
+            Sorted = np.asarray(self.series)[self.order]
+            self.bounds = np.searchsorted(Sorted, np.arange(0, len(self.names)+1))
+        return self.order, self.bounds
+
+    def Series(self, name, asof = None):
+        ## series as known on date asof (latest release on or before it of every period), all releases if None
+        sid = self.names.index(name)
+        Order, Bounds = self.Index()
+        Rows = Order[Bounds[sid]:Bounds[sid+1]]
+        Period, Release, Value = self.period[Rows], self.release[Rows], self.value[Rows]
+        Valid = Release <= (Day(asof) if asof is not None else np.iinfo(np.int64).max)
+        # releases of a period are in order, so the latest valid one is followed by an invalid one or a new period
+        Keep = Valid & ~(np.append(Period[1:] == Period[:-1], False) & np.append(Valid[1:], False))
+        return pd.Series(Value[Keep], index=Periods(Period[Keep], self.freqs[sid]), name=name)
+
+    def Append(self, name, Data, release):
+        ## add the release of series name published on date release, Data a pandas series indexed by period (or dates).
+        ## Only values that are new or revised compared with what was known on that date are written.
+        Data = Data.astype(float)
+        if isinstance(Data.index, pd.DatetimeIndex):
+            freq = Data.index.freqstr or (pd.infer_freq(Data.index) if len(Data) > 2 else None)
+            if freq is None:
+                raise ValueError('cannot tell the frequency of the dates of %s, index it by period' % name)
+            Data.index = Data.index.to_period(PeriodOffset(freq))
+        elif not isinstance(Data.index, pd.PeriodIndex):
+            raise ValueError('%s must be indexed by period or dates' % name)
+        if name not in self.names:
+            self.names.append(name)
+            self.freqs.append(Data.index.freqstr)
+            with open(self.file + '.tmp', 'w') as Out:
+                json.dump({'names': self.names, 'freqs': self.freqs}, Out)
+            os.replace(self.file + '.tmp', self.file)
+            self.order = None
+        sid = self.names.index(name)
+        if Data.index.freqstr != self.freqs[sid]:
+            raise ValueError('%s is stored with frequency %s, not %s' % (name, self.freqs[sid], Data.index.freqstr))
+        Known = self.Series(name, release).reindex(Data.index)
+        New = ~((Known.values == Data.values) | (np.isnan(Known.values) & np.isnan(Data.values)))
+        if not New.any():
+            return 0
+        Records = {'series': np.full(New.sum(), sid), 'period': Data.index.asi8[New], 'release': np.full(New.sum(), Day(release)), 'value': Data.values[New]}
+        for key, dtype in Columns.items():
+            with open(os.path.join(self.root, key), 'ab') as Out:
+                Out.write(np.asarray(Records[key], dtype=dtype).tobytes())
+        self.Open()
+        return int(New.sum()) # records written
+
+    def Releases(self, name = None):
+        ## dates on which anything (or series name) was released
+        Release = self.release if name is None else self.release[np.asarray(self.series) == self.names.index(name)]
+        return pd.to_datetime(np.unique(Release).astype('datetime64[D]'))
+
+    def Snapshot(self, asof, monthly, quarterly, start = None):
+        ## GDP and monthlyseries arrays for ForecastCombine from the data known on date asof
+        ## quarterly = name of the target series, monthly = names of the monthly series, start = first quarter (e.g. '1992Q2')
+        ## Monthly series run from the first month of the first quarter to the end of the quarter after the last GDP release
+        ## (the nowcast quarter), NaN where not yet released.
+        GDP = self.Series(quarterly, asof)
+        GDP = GDP.loc[pd.Period(start, freq='Q'):] if start is not None else GDP
+        Months = pd.period_range(GDP.index[0].asfreq('M', how='start'), periods=3*(len(GDP)+1), freq='M')
+        monthlyseries = [self.Series(name, asof).reindex(Months).values.reshape(-1,1) for name in monthly]
+        return GDP.values.reshape(-1,1), monthlyseries